@@ -2,22 +2,31 @@ import os
 import logging
 import jwt
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 from flask_swagger_ui import get_swaggerui_blueprint
 from flask_migrate import Migrate
 from database import db
 import threading
 import json
+import uuid
+import hmac
+import time
+import click
+from functools import lru_cache
 from pathlib import Path
+import log_pipeline
 
-# Configure basic logging
-logging.basicConfig(level=logging.INFO)
+# Log through a background writer that also captures per-task logs
+log_pipeline.setup_logging()
 logger = logging.getLogger(__name__)
 
 # Constants
 CONFIG_FILE = 'config.json'
 SWAGGER_URL = '/swagger'
 API_URL = '/static/swagger.json'
+DASHBOARD_TASK_LIMIT = int(os.environ.get('DASHBOARD_TASK_LIMIT', '200'))
+# Admin token for GET /api/export/results; the endpoint is disabled when unset
+EXPORT_API_TOKEN = os.environ.get('EXPORT_API_TOKEN')
 
 def load_config():
     try:
@@ -50,13 +59,34 @@ app.config.update(
 db.init_app(app)
 migrate = Migrate(app, db)
 
-from tasks import TaskQueue
-from crew_manager import CrewManager
-import tools.search_1688 as search_tool
-
-# Initialize core components
+from tasks import TaskQueue, TERMINAL_STATUSES, track_round_trips, round_trip_stats
+from task_cache import task_response_cache
+from crew_manager import PIPELINE_MODES
+from tools import tmapi
+import cache_warmer
+import exporter
+import job_lease
+import llm_batcher
+import task_control
+import retention
+import task_profiler
+import title_memo
+import circuit_breaker
+
+# Initialize core components. The CrewManager pulls in crewai and telemetry,
+# so it is created on the first task instead of at worker boot.
 task_queue = TaskQueue()
-crew_manager = CrewManager()
+_crew_manager = None
+_crew_manager_lock = threading.Lock()
+
+def get_crew_manager():
+    global _crew_manager
+    if _crew_manager is None:
+        with _crew_manager_lock:
+            if _crew_manager is None:
+                from crew_manager import CrewManager
+                _crew_manager = CrewManager()
+    return _crew_manager
 
 # Load and sync configuration
 config = load_config()
@@ -78,10 +108,23 @@ def generate_task_token(task_id):
     }
     return jwt.encode(payload, app.secret_key, algorithm='HS256')
 
-def process_task_async(task_id, task_description):
-    with app.app_context():
+@lru_cache(maxsize=4096)
+def _decode_task_token(token):
+    # Only successful decodes are cached; expiry is re-checked on every use
+    return jwt.decode(token, app.secret_key, algorithms=['HS256'])
+
+def verify_task_token(token, task_id):
+    """Return True if token is a valid, unexpired token for task_id"""
+    try:
+        payload = _decode_task_token(token)
+    except jwt.InvalidTokenError:
+        return False
+    return payload['task_id'] == task_id and payload['exp'] > time.time()
+
+def process_task_async(task_id, task_description, mode='crew', previous=None, profile_hz=None):
+    with app.app_context(), track_round_trips(task_id):
         try:
-            crew_manager.process_task(task_id, task_description)
+            get_crew_manager().process_task(task_id, task_description, mode, previous, profile_hz)
         except Exception as e:
             logger.error(f"Error processing task {task_id}: {str(e)}")
             task_queue.update_task(task_id, 'failed', str(e))
@@ -94,7 +137,7 @@ def home():
 @app.route('/tasks')
 def task_dashboard():
     return render_template('tasks.html', 
-                         tasks=task_queue.get_all_tasks(), 
+                         tasks=task_queue.get_all_tasks(limit=DASHBOARD_TASK_LIMIT), 
                          search_mode=app.config['search_mode'])
 
 @app.route('/tasks/<task_id>/logs')
@@ -104,7 +147,21 @@ def task_logs(task_id):
         return jsonify({'error': 'Task not found'}), 404
 
     try:
-        logs = task.get('logs', []) if isinstance(task.get('logs'), list) else []
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = min(max(request.args.get('limit', 200, type=int), 1), 1000)
+        page = log_pipeline.task_log_store.read(task_id, offset=offset, limit=limit)
+        logs = {
+            'task_logs': page['entries'],
+            'metadata': {
+                'status': task['status'],
+                'created_at': task['created_at'],
+                'completed_at': task['completed_at'],
+                'log_entries': page['total']
+            },
+            'offset': offset,
+            'limit': limit,
+            'total': page['total']
+        }
         return render_template('task_logs.html', task_id=task_id, logs=logs)
     except Exception as e:
         logger.error(f"Error processing task logs: {str(e)}")
@@ -114,6 +171,25 @@ def task_logs(task_id):
             'metadata': {'error': str(e)}
         })
 
+@app.route('/tasks/<task_id>/profile')
+def task_profile(task_id):
+    """Sampling profile of a task submitted with "profile"; ?format=folded returns flamegraph input"""
+    task = task_queue.get_task(task_id)
+    if not task:
+        return jsonify({'error': 'Task not found'}), 404
+
+    profile = task_queue.get_profile(task_id)
+    if profile is None:
+        return jsonify({'error': 'Task was not profiled'}), 404
+
+    output_format = request.args.get('format', 'html')
+    if output_format == 'folded':
+        return Response(profile['folded'] + '\n', mimetype='text/plain',
+                        headers={'Content-Disposition': f'attachment; filename={task_id}.folded'})
+    if output_format == 'json':
+        return jsonify(profile), 200
+    return render_template('task_profile.html', task_id=task_id, task=task, profile=profile)
+
 @app.route('/api/tasks', methods=['POST'])
 def create_task():
     try:
@@ -127,13 +203,26 @@ def create_task():
             if not all([urlparse(webhook_url).scheme, urlparse(webhook_url).netloc]):
                 return jsonify({'error': 'Invalid webhook URL'}), 400
 
-        task_id = task_queue.add_task(data['task'], data['user_id'], webhook_url)
+        mode = data.get('mode', 'crew')
+        if mode not in PIPELINE_MODES:
+            return jsonify({'error': 'Invalid mode value'}), 400
+
+        try:
+            profile_hz = task_profiler.profile_hz(data.get('profile'))
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+
+        task_id = str(uuid.uuid4())
         token = generate_task_token(task_id)
-        task_queue.update_task_metadata(task_id, {'token': token})
+        metadata = {'token': token, 'mode': mode}
+        if profile_hz:
+            metadata['profile'] = {'hz': profile_hz}
+        task_queue.add_task(data['task'], data['user_id'], webhook_url,
+                            task_id=task_id, metadata=metadata)
 
         thread = threading.Thread(
             target=process_task_async,
-            args=(task_id, data['task'])
+            args=(task_id, data['task'], mode, None, profile_hz)
         )
         thread.daemon = True
         thread.start()
@@ -141,7 +230,8 @@ def create_task():
         return jsonify({
             'task_id': task_id,
             'token': token,
-            'status': 'pending'
+            'status': 'pending',
+            'mode': mode
         }), 201
 
     except Exception as e:
@@ -155,23 +245,212 @@ def get_task_status(task_id):
         if not token:
             return jsonify({'error': 'Missing authorization token'}), 401
 
-        try:
-            payload = jwt.decode(token, app.secret_key, algorithms=['HS256'])
-            if payload['task_id'] != task_id:
-                return jsonify({'error': 'Invalid token'}), 401
-        except jwt.InvalidTokenError:
+        if not verify_task_token(token, task_id):
             return jsonify({'error': 'Invalid token'}), 401
 
-        task = task_queue.get_task(task_id)
-        if not task:
+        version = task_queue.get_task_version(task_id)
+        if version is None:
             return jsonify({'error': 'Task not found'}), 404
 
-        return jsonify(task), 200
+        etag = f'{task_id}-{version}'
+        if request.if_none_match.contains(etag):
+            task_response_cache.record_not_modified()
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        body = task_response_cache.get(task_id, version)
+        if body is None:
+            task = task_queue.get_task(task_id)
+            if not task:
+                return jsonify({'error': 'Task not found'}), 404
+            version, etag = task['version'], f"{task_id}-{task['version']}"
+            body = app.json.dumps(task).encode('utf-8')
+            if task['status'] in TERMINAL_STATUSES:
+                task_response_cache.put(task_id, version, body)
+
+        response = Response(body, status=200, mimetype='application/json')
+        response.set_etag(etag)
+        return response
 
     except Exception as e:
         logger.error(f"Error getting task status: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/tasks/<task_id>', methods=['DELETE'])
+def cancel_task(task_id):
+    try:
+        token = request.headers.get('Authorization')
+        if not token:
+            return jsonify({'error': 'Missing authorization token'}), 401
+
+        if not verify_task_token(token, task_id):
+            return jsonify({'error': 'Invalid token'}), 401
+
+        # The status change is the cancellation signal; workers in other processes poll for it
+        cancelled = task_queue.update_task(task_id, 'cancelled',
+                                           metadata={'cancelled_at': datetime.utcnow().isoformat()},
+                                           notify_in_background=True)
+        if not cancelled:
+            status = task_queue.get_task_status(task_id)
+            if status is None:
+                return jsonify({'error': 'Task not found'}), 404
+            return jsonify({'error': f'Task is already {status}', 'status': status}), 409
+
+        task_control.cancel(task_id)
+        return jsonify({'task_id': task_id, 'status': 'cancelled'}), 200
+
+    except Exception as e:
+        logger.error(f"Error cancelling task: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/tasks/<task_id>/refresh', methods=['POST'])
+def refresh_task(task_id):
+    """Re-run a completed task as a new task, reusing its keyword and candidate set"""
+    try:
+        token = request.headers.get('Authorization')
+        if not token:
+            return jsonify({'error': 'Missing authorization token'}), 401
+
+        if not verify_task_token(token, task_id):
+            return jsonify({'error': 'Invalid token'}), 401
+
+        previous = task_queue.get_task(task_id)
+        if not previous:
+            return jsonify({'error': 'Task not found'}), 404
+        if previous['status'] != 'completed':
+            return jsonify({'error': f"Task is {previous['status']}; only completed tasks can be refreshed",
+                            'status': previous['status']}), 409
+        if not ((previous['metadata'] or {}).get('pipeline') or {}).get('keyword'):
+            return jsonify({'error': 'Task has no stored search keyword; submit the query as a new task'}), 409
+
+        refresh_id = str(uuid.uuid4())
+        refresh_token = generate_task_token(refresh_id)
+        task_queue.add_task(previous['description'], previous['user_id'], previous['webhook_url'],
+                            task_id=refresh_id,
+                            metadata={'token': refresh_token, 'mode': 'refresh', 'refresh_of': task_id})
+
+        thread = threading.Thread(
+            target=process_task_async,
+            args=(refresh_id, previous['description'], 'refresh', previous)
+        )
+        thread.daemon = True
+        thread.start()
+
+        # The new task's changes field reports what changed once the refresh completes
+        return jsonify({
+            'task_id': refresh_id,
+            'token': refresh_token,
+            'status': 'pending',
+            'refresh_of': task_id
+        }), 202
+
+    except Exception as e:
+        logger.error(f"Error refreshing task: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/tasks/<task_id>/logs', methods=['GET'])
+def get_task_logs(task_id):
+    try:
+        token = request.headers.get('Authorization')
+        if not token:
+            return jsonify({'error': 'Missing authorization token'}), 401
+
+        if not verify_task_token(token, task_id):
+            return jsonify({'error': 'Invalid token'}), 401
+
+        offset = request.args.get('offset', 0, type=int)
+        limit = request.args.get('limit', 100, type=int)
+        level = request.args.get('level', 'DEBUG').upper()
+        min_level = logging.getLevelName(level)
+        if offset < 0 or not 1 <= limit <= 1000 or not isinstance(min_level, int):
+            return jsonify({'error': 'Invalid offset, limit or level'}), 400
+
+        if task_queue.get_task_version(task_id) is None:
+            return jsonify({'error': 'Task not found'}), 404
+
+        page = log_pipeline.task_log_store.read(task_id, offset=offset, limit=limit, min_level=min_level)
+        next_offset = offset + len(page['entries'])
+        return jsonify({
+            'task_id': task_id,
+            'logs': page['entries'],
+            'offset': offset,
+            'limit': limit,
+            'total': page['total'],
+            'next_offset': next_offset if next_offset < page['total'] else None
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Error getting task logs: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def parse_export_filters(args):
+    """Parse export filters from request args; dates are ISO 8601, end is exclusive"""
+    filters = {'user_id': args.get('user_id') or None, 'status': args.get('status') or None}
+    for key in ('start', 'end'):
+        filters[key] = datetime.fromisoformat(args[key]) if args.get(key) else None
+    return filters
+
+@app.route('/api/export/results', methods=['GET'])
+def export_results():
+    """Admin-only: every user's results, authorized with EXPORT_API_TOKEN"""
+    try:
+        if not EXPORT_API_TOKEN:
+            return jsonify({'error': 'Export API is disabled; use the flask export-results command'}), 403
+        token = request.headers.get('Authorization')
+        if not token:
+            return jsonify({'error': 'Missing authorization token'}), 401
+        if not hmac.compare_digest(token.encode('utf-8'), EXPORT_API_TOKEN.encode('utf-8')):
+            return jsonify({'error': 'Invalid token'}), 401
+
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in exporter.EXPORT_FORMATS:
+            return jsonify({'error': 'Invalid format value'}), 400
+        try:
+            filters = parse_export_filters(request.args)
+        except ValueError:
+            return jsonify({'error': 'Invalid date filter'}), 400
+
+        if export_format == 'parquet':
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                return jsonify({'error': 'Parquet export requires pyarrow (the export extra)'}), 400
+            body = exporter.stream_parquet(exporter.iter_records(**filters))
+            mimetype = 'application/vnd.apache.parquet'
+        else:
+            body = exporter.stream_ndjson(exporter.iter_records(**filters))
+            mimetype = 'application/x-ndjson'
+
+        return Response(stream_with_context(body), mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename=results.{export_format}'
+        })
+
+    except Exception as e:
+        logger.error(f"Error exporting results: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify({
+        'prefetch': tmapi.detail_prefetcher.stats(),
+        'cache': tmapi.cache_stats(),
+        'catalog': tmapi.catalog.stats(),
+        'db_round_trips': round_trip_stats(),
+        'task_response_cache': task_response_cache.stats(),
+        'llm_batching': llm_batcher.stats(),
+        'title_memo': title_memo.stats(),
+        'logging': log_pipeline.stats(),
+        'circuit_breakers': circuit_breaker.stats(),
+        'retention': job_lease.last_report(retention.JOB_NAME) or retention.last_report,
+        'cache_warmer': job_lease.last_report(cache_warmer.JOB_NAME) or cache_warmer.last_report
+    }), 200
+
+@app.route('/api/circuit_breakers', methods=['GET'])
+def get_circuit_breakers():
+    """State of the tmapi and LLM circuit breakers"""
+    return jsonify(circuit_breaker.stats()), 200
+
 @app.route('/api/config/search_mode', methods=['POST'])
 def update_search_mode():
     try:
@@ -196,6 +475,58 @@ def update_search_mode():
         logger.error(f"Error updating search mode: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.cli.command('warm-cache')
+def warm_cache_command():
+    """Refresh cached tmapi responses for the most requested queries and items"""
+    report = cache_warmer.CacheWarmer().run()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+@app.cli.command('export-results')
+@click.option('--format', 'export_format', type=click.Choice(exporter.EXPORT_FORMATS), default='ndjson')
+@click.option('--start', help='Only tasks created at or after this ISO date')
+@click.option('--end', help='Only tasks created before this ISO date')
+@click.option('--user-id', help='Only tasks of this user')
+@click.option('--status', help='Only tasks with this status')
+@click.option('--output', type=click.Path(dir_okay=False), required=True)
+def export_results_command(export_format, start, end, user_id, status, output):
+    """Export flattened task result items as NDJSON or Parquet"""
+    if export_format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise click.UsageError('Parquet export requires pyarrow (pip install ".[export]")')
+    try:
+        filters = parse_export_filters({'start': start, 'end': end, 'user_id': user_id, 'status': status})
+    except ValueError:
+        raise click.UsageError('Invalid --start or --end date')
+    records = exporter.iter_records(**filters)
+    if export_format == 'parquet':
+        with open(output, 'wb') as f:
+            for chunk in exporter.stream_parquet(records):
+                f.write(chunk)
+    else:
+        with open(output, 'w', encoding='utf-8') as f:
+            for line in exporter.stream_ndjson(records):
+                f.write(line)
+
+@app.cli.command('retention')
+@click.option('--archive-days', type=int, help='Archive results of finished tasks older than this')
+@click.option('--delete-days', type=int, help='Delete tasks older than this (0 keeps them)')
+@click.option('--cache-days', type=int, help='Remove live api_cache files older than this')
+@click.option('--cache-max-bytes', type=int, help='Remove the oldest live api_cache files above this size (0 for no cap)')
+def retention_command(archive_days, delete_days, cache_days, cache_max_bytes):
+    """Archive old task results and prune api_cache and task logs"""
+    report = retention.RetentionJob(archive_days=archive_days, delete_days=delete_days,
+                                    cache_days=cache_days, cache_max_bytes=cache_max_bytes).run()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+# Every worker starts the schedulers; a job_run row lets only one of them run each day's job
+if os.environ.get("CACHE_WARMER_ENABLED", "false").lower() == "true":
+    cache_warmer.start_scheduler(app)
+
+if os.environ.get("RETENTION_ENABLED", "false").lower() == "true":
+    retention.start_scheduler(app)
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Not found'}), 404
@@ -203,7 +534,3 @@ def not_found(error):
 @app.errorhandler(500)
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
-
-# Create database tables
-with app.app_context():
-    db.create_all()
\ No newline at end of file
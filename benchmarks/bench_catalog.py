@@ -0,0 +1,94 @@
+"""Benchmark local catalog ingestion, index build and query latency at scale.
+
+Synthetic titles are assembled from fragments of the titles recorded in
+api_cache, so n-gram frequencies resemble real 1688 listings.
+
+    python benchmarks/bench_catalog.py [--items 1000000] [--queries 200]
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from tools.catalog import ItemCatalog  # noqa: E402
+
+
+def recorded_fragments():
+    fragments = set()
+    for path in glob.glob(os.path.join("api_cache", "*.json")):
+        with open(path) as f:
+            data = json.load(f).get("data") or {}
+        titles = [item.get("title", "") for item in data.get("items", [])] + [data.get("title") or ""]
+        for title in titles:
+            for size in (2, 3, 4):
+                fragments.update(title[i:i + size] for i in range(0, len(title) - size + 1, size))
+    return sorted(f for f in fragments if f.strip())
+
+
+def synthetic_records(count, fragments, rng):
+    for i in range(count):
+        yield {
+            "item_id": str(10 ** 11 + i),
+            "title": "".join(rng.choice(fragments) for _ in range(rng.randint(8, 14))),
+            "product_url": f"https://detail.1688.com/offer/{10 ** 11 + i}.html",
+            "price": round(rng.uniform(1, 500), 2),
+            "goods_score": round(rng.uniform(3, 5), 1),
+            "repurchase_rate": float(rng.randint(0, 100)),
+            "orders_count": rng.randint(0, 10000),
+            "sku_props": None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1688)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    fragments = recorded_fragments()
+    workdir = tempfile.mkdtemp()
+    catalog = ItemCatalog(os.path.join(workdir, "catalog.sqlite"))
+
+    started = time.perf_counter()
+    batch = []
+    for record in synthetic_records(args.items, fragments, rng):
+        batch.append(record)
+        if len(batch) >= args.batch:
+            catalog.upsert(batch)
+            batch = []
+    catalog.upsert(batch)
+    ingest = time.perf_counter() - started
+    print(f"ingest  {args.items} items: {ingest:.1f}s ({args.items / ingest:,.0f} items/s)")
+
+    started = time.perf_counter()
+    catalog.load()
+    print(f"index build: {time.perf_counter() - started:.1f}s, {catalog.stats()['ngrams']} n-grams, "
+          f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+    queries = ["".join(rng.choice(fragments) for _ in range(rng.randint(1, 3))) for _ in range(args.queries)]
+    for label, filters in (("text", {}), ("text+filters", {"min_price": 20, "max_price": 200, "min_orders": 100})):
+        durations, hits = [], []
+        for query in queries:
+            t0 = time.perf_counter()
+            hits.append(len(catalog.search(query, limit=20, **filters)))
+            durations.append((time.perf_counter() - t0) * 1000)
+        durations.sort()
+        print(f"query {label:<13} median={statistics.median(durations):.2f}ms "
+              f"p95={durations[int(len(durations) * 0.95)]:.2f}ms mean hits={statistics.mean(hits):.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Measure the logging cost paid by the thread that processes a task.
+
+Replays the log calls made while formatting a crew result and handling a
+search: the old setup (crew_manager and tmapi loggers forced to DEBUG,
+f-string messages, a synchronous stream handler) against the queue-based
+pipeline from log_pipeline (lazy %-formatting, background writer), outside a
+task and inside one, where records are also written to the per-task store.
+Each setup runs in a fresh interpreter with log output sent to /dev/null.
+
+    python benchmarks/bench_logging.py [--iterations 2000]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETUPS = ("before", "after", "after_in_task")
+
+
+def sample_result():
+    items = [{
+        "item_id": str(700000000000 + i),
+        "title": "厂家定制九龙山新茶出口非洲乌兹绿茶茶叶眉茶9366定做",
+        "price": 12.0 + i,
+        "product_url": f"https://detail.1688.com/offer/{700000000000 + i}.html",
+        "repurchase_rate": 37.0,
+        "item_score": 4.8,
+        "orders_count": 125 + i,
+        "props_names": "规格:500克;包装:袋装",
+        "english_title": "Custom Jiulongshan green tea for export, 500g",
+    } for i in range(20)]
+    return {"items": items, "metadata": {"query": "green tea 500g", "timestamp": "2024-01-01T00:00:00"}}
+
+
+def worker(setup, iterations):
+    import logging
+    sys.stderr = open(os.devnull, "w")
+    sys.path.insert(0, ROOT)
+
+    crew_logger = logging.getLogger("crew_manager")
+    tmapi_logger = logging.getLogger("tools.tmapi")
+    result = sample_result()
+
+    if setup == "before":
+        logging.basicConfig(level=logging.INFO)
+        crew_logger.setLevel(logging.DEBUG)
+        tmapi_logger.setLevel(logging.DEBUG)
+
+        def calls():
+            result_str = json.dumps(result, ensure_ascii=False)
+            crew_logger.debug(f"Raw result type: {type(result)}")
+            crew_logger.debug(f"Raw result: {result}")
+            crew_logger.debug(f"After string conversion: {result_str}")
+            crew_logger.debug(f"After markdown strip: {result_str}")
+            tmapi_logger.debug(f"Search request - Mock: {True}, Query: {'眉茶'}, Cache file: {'api_cache/x.json'}")
+            tmapi_logger.info(f"Successfully processed {len(result['items'])} items")
+            crew_logger.info(f"Fast pipeline finished task {'t'} in {0.01}s")
+    else:
+        os.environ["TASK_LOG_DIR"] = tempfile.mkdtemp()
+        import log_pipeline
+        import task_control
+        log_pipeline.setup_logging()
+        if setup == "after_in_task":
+            log_pipeline.task_log_store.max_bytes = 1 << 40
+            task_control.start("bench-task")
+
+        def calls():
+            result_str = json.dumps(result, ensure_ascii=False)
+            crew_logger.debug("Raw result type: %s", type(result))
+            crew_logger.debug("Raw result: %s", result)
+            crew_logger.debug("After string conversion: %s", result_str)
+            crew_logger.debug("After markdown strip: %s", result_str)
+            tmapi_logger.debug("Search request - Mock: %s, Query: %s, Cache file: %s", True, '眉茶', 'api_cache/x.json')
+            tmapi_logger.info("Successfully processed %d items", len(result['items']))
+            crew_logger.info("Fast pipeline finished task %s in %ss", 't', 0.01)
+
+    # Baseline: the same work without the log calls
+    result_str_only = time.perf_counter()
+    for _ in range(iterations):
+        json.dumps(result, ensure_ascii=False)
+    baseline = time.perf_counter() - result_str_only
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        calls()
+    elapsed = time.perf_counter() - started
+
+    drain = 0.0
+    if setup != "before":
+        drain_start = time.perf_counter()
+        handler = log_pipeline._state["handler"]
+        while not handler.queue.empty():
+            time.sleep(0.001)
+        drain = time.perf_counter() - drain_start
+
+    print(json.dumps({
+        "setup": setup,
+        "us_per_iteration": round((elapsed - baseline) / iterations * 1e6, 2),
+        "writer_drain_s": round(drain, 3),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--worker", choices=SETUPS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.iterations)
+        return
+
+    print(f"{'setup':<16}{'caller us/iter':>16}{'writer drain s':>16}")
+    for setup in SETUPS:
+        output = subprocess.run([sys.executable, __file__, "--worker", setup, "--iterations", str(args.iterations)],
+                                cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        row = json.loads(output.strip().splitlines()[-1])
+        print(f"{setup:<16}{row['us_per_iteration']:>16}{row['writer_drain_s']:>16}")
+
+
+if __name__ == "__main__":
+    main()
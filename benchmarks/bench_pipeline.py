@@ -0,0 +1,93 @@
+"""Compare the crew and fast pipeline execution engines on recorded data.
+
+The fast pipeline is replayed against the responses recorded in api_cache,
+using the Chinese keyword stored in each recorded search response so that no
+LLM call is needed. Pass --with-llm to include the query analysis and title
+translation calls, and --crew to also run the full agent crew (requires
+OPENAI_API_KEY and crewai).
+
+    python benchmarks/bench_pipeline.py [--repeat 5] [--with-llm] [--crew]
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ["API_MODE"] = "mocked_data"
+# Recorded data does not cover every item, missing details are expected
+logging.disable(logging.ERROR)
+
+from fast_pipeline import FastPipeline  # noqa: E402
+
+
+def recorded_keywords():
+    keywords = set()
+    for path in glob.glob(os.path.join("api_cache", "search_*.json")):
+        with open(path) as f:
+            data = json.load(f)
+        keyword = data.get("data", {}).get("keyword")
+        if keyword and data.get("data", {}).get("page_size") == 20:
+            keywords.add(keyword)
+    return sorted(keywords)
+
+
+def summarize(name, durations):
+    durations = sorted(durations)
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+    print(f"{name:<6} runs={len(durations):<4} mean={statistics.mean(durations):.3f}s "
+          f"median={statistics.median(durations):.3f}s p95={p95:.3f}s")
+
+
+def bench_fast(keywords, repeat, with_llm):
+    pipeline = FastPipeline(translate=with_llm)
+    durations = []
+    for _ in range(repeat):
+        for keyword in keywords:
+            analysis = None if with_llm else {"keyword": keyword, "variant_terms": []}
+            started = time.perf_counter()
+            result, _ = pipeline.run(keyword, analysis=analysis)
+            durations.append(time.perf_counter() - started)
+            assert "items" in result and "metadata" in result
+    return durations
+
+
+def bench_crew(keywords):
+    from crewai import Crew
+    from crew_manager import CrewManager
+
+    manager = CrewManager()
+    durations = []
+    for keyword in keywords:
+        started = time.perf_counter()
+        agents = {name: manager.create_agent(name, config)
+                  for name, config in manager.agent_configs.items()}
+        tasks = [manager.create_task(task_name, config, agents[config['agent']], keyword)[0]
+                 for task_name, config in manager.task_configs.items()]
+        Crew(agents=list(agents.values()), tasks=tasks, verbose=False).kickoff()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--with-llm", action="store_true")
+    parser.add_argument("--crew", action="store_true")
+    args = parser.parse_args()
+
+    keywords = recorded_keywords()
+    print(f"Recorded queries: {len(keywords)}")
+    summarize("fast", bench_fast(keywords, args.repeat, args.with_llm))
+    if args.crew:
+        summarize("crew", bench_crew(keywords))
+
+
+if __name__ == "__main__":
+    main()
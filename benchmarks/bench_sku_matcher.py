@@ -0,0 +1,195 @@
+"""Benchmark variant selection on the recorded item details in api_cache.
+
+For every item with more than one SKU, each SKU in turn is the buyer's target:
+a query is built from its property values the way a buyer writes it (weights,
+volumes and sizes in English units, colors as English words) together with the
+variant terms the query analysis would extract for the rest. The previous
+substring matcher from FastPipeline is compared with sku_matcher on
+
+- accuracy: the chosen SKU has the target's property values,
+- pick rate: how often sku_matcher selects a variant outright, and how often
+  that pick is right,
+- top-k recall: the target is among the variants handed to the detail agent,
+- the hand-written counter-examples below, where a color word is part of the
+  product name and must not become a constraint,
+- time per item and the size of the item_detail tool output before and after
+  trimming, which is what the detail agent reads for every candidate.
+
+    python benchmarks/bench_sku_matcher.py [--max-skus 20]
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import sku_matcher  # noqa: E402
+
+ENGLISH_COLORS = {}
+for _word, _fragment in sku_matcher.COLORS.items():
+    ENGLISH_COLORS.setdefault(_fragment, _word)
+
+
+# (query, keyword, variant terms, detail, props_names of the SKU the buyer wants)
+COUNTER_EXAMPLES = [
+    ("anhua black tea 1kg", "安化黑茶", [], {
+        "title": "安化黑茶 金花茯砖茶",
+        "skus": [
+            {"props_names": "规格:250克黑色礼盒", "sale_price": "68.00", "stock": 100},
+            {"props_names": "规格:500克简装", "sale_price": "45.00", "stock": 100},
+            {"props_names": "规格:1000克简装", "sale_price": "80.00", "stock": 100},
+        ],
+    }, "规格:1000克简装"),
+    ("red wine glass 6pcs", "红酒杯", [], {
+        "title": "水晶红酒杯 高脚杯",
+        "skus": [
+            {"props_names": "数量:2只;颜色:红色", "sale_price": "19.00", "stock": 100},
+            {"props_names": "数量:6只;颜色:透明", "sale_price": "49.00", "stock": 100},
+        ],
+    }, "数量:6只;颜色:透明"),
+]
+
+
+def legacy_select_variant(detail, variant_terms):
+    """The substring matcher FastPipeline used before sku_matcher"""
+    skus = (detail or {}).get("skus") or []
+    if not skus:
+        return None
+
+    def price(sku):
+        try:
+            return float(sku.get("sale_price"))
+        except (TypeError, ValueError):
+            return math.inf
+
+    def score(sku):
+        names = sku.get("props_names", "")
+        matches = sum(1 for term in variant_terms if term and term in names)
+        in_stock = 1 if (sku.get("stock") or 0) > 0 else 0
+        return (matches, in_stock, -price(sku))
+
+    return max(skus, key=score)
+
+
+def render_quantity(quantity):
+    value = quantity.low
+    if quantity.kind == "weight":
+        return f"{value / 1000:g}kg" if value >= 1000 and value % 1000 == 0 else f"{value:g}g"
+    if quantity.kind == "volume":
+        return f"{value / 1000:g}l" if value >= 1000 and value % 1000 == 0 else f"{value:g}ml"
+    if quantity.kind == "length":
+        return f"{value:g}cm"
+    if quantity.kind == "size":
+        return f"size {value:g}"
+    if quantity.kind == "count":
+        return f"{value:g}pcs"
+    return None
+
+
+def buyer_query(detail, sku):
+    """English query and Chinese variant terms naming the SKU's property values"""
+    words = [detail.get("title", "")[:12]]
+    variant_terms = []
+    for pair in (sku.get("props_names") or "").split(";"):
+        name = pair.rpartition(":")[2]
+        quantities = sku_matcher.parse_quantities(name)
+        rendered = render_quantity(quantities[0]) if quantities else None
+        if rendered:
+            words.append(rendered)
+            # The rest of the name (铁罐装 in 500克铁罐装) is what the analysis would extract
+            name = sku_matcher._QUANTITY.sub("", name, count=1)
+        fragment = next((f for f in ENGLISH_COLORS if f in name), None)
+        if fragment and len(name) <= 3:
+            words.append(ENGLISH_COLORS[fragment])
+            continue
+        term = re.sub(r"[【】（）()\[\]\s]", "", name)
+        if term:
+            variant_terms.append(term)
+    return " ".join(words), variant_terms
+
+
+def load_corpus():
+    details = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "api_cache", "item_detail_*.json"))):
+        with open(path) as f:
+            detail = json.load(f).get("data") or {}
+        if len(detail.get("skus") or []) > 1:
+            details.append(detail)
+    return details
+
+
+def same_variant(a, b):
+    return a is not None and b is not None and a.get("props_names") == b.get("props_names")
+
+
+def benchmark_cases(details, max_skus):
+    for detail in details:
+        for target in detail["skus"][:max_skus]:
+            query, variant_terms = buyer_query(detail, target)
+            yield query, detail.get("title", "")[:12], variant_terms, detail, target
+    for query, keyword, variant_terms, detail, props_names in COUNTER_EXAMPLES:
+        target = next(sku for sku in detail["skus"] if sku["props_names"] == props_names)
+        yield query, keyword, variant_terms, detail, target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-skus", type=int, default=20, help="target SKUs per item")
+    parser.add_argument("--top-n", type=int, default=sku_matcher.TOP_N)
+    args = parser.parse_args()
+
+    details = load_corpus()
+    totals = {"cases": 0, "legacy": 0, "matcher": 0, "picked": 0, "picked_right": 0, "top_k": 0,
+              "counter_legacy": 0, "counter_matcher": 0,
+              "legacy_s": 0.0, "matcher_s": 0.0, "full_bytes": 0, "trimmed_bytes": 0}
+    counter_examples = [id(case[3]) for case in COUNTER_EXAMPLES]
+    for query, keyword, variant_terms, detail, target in benchmark_cases(details, args.max_skus):
+        totals["cases"] += 1
+
+        started = time.perf_counter()
+        legacy = legacy_select_variant(detail, variant_terms + query.split()[1:])
+        totals["legacy_s"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        constraints = sku_matcher.parse_constraints(query, keyword, variant_terms)
+        result = sku_matcher.match(detail, constraints)
+        totals["matcher_s"] += time.perf_counter() - started
+
+        chosen = result["selected"] or (result["variants"][0][1] if result["variants"] else None)
+        totals["legacy"] += same_variant(legacy, target)
+        totals["matcher"] += same_variant(chosen, target)
+        if id(detail) in counter_examples:
+            totals["counter_legacy"] += same_variant(legacy, target)
+            totals["counter_matcher"] += same_variant(chosen, target)
+        if result["selected"] is not None:
+            totals["picked"] += 1
+            totals["picked_right"] += same_variant(result["selected"], target)
+        totals["top_k"] += any(same_variant(sku, target) for _, sku in result["variants"][:args.top_n])
+
+        trimmed = sku_matcher.trim_detail(detail, constraints, args.top_n)
+        totals["full_bytes"] += len(json.dumps(detail, ensure_ascii=False).encode("utf-8"))
+        totals["trimmed_bytes"] += len(json.dumps(trimmed, ensure_ascii=False).encode("utf-8"))
+
+    cases = totals["cases"] or 1
+    sku_counts = sorted(len(d["skus"]) for d in details)
+    print(f"items with variants: {len(details)}  SKUs per item: "
+          f"min {sku_counts[0] if sku_counts else 0}, max {sku_counts[-1] if sku_counts else 0}  cases: {totals['cases']}")
+    print(f"{'':<28}{'legacy':>12}{'sku_matcher':>14}")
+    print(f"{'accuracy':<28}{totals['legacy'] / cases:>12.1%}{totals['matcher'] / cases:>14.1%}")
+    counter = [f"{totals[key]}/{len(COUNTER_EXAMPLES)}" for key in ("counter_legacy", "counter_matcher")]
+    print(f"{'color in product name':<28}{counter[0]:>12}{counter[1]:>14}")
+    print(f"{'time per item (us)':<28}{totals['legacy_s'] / cases * 1e6:>12.1f}{totals['matcher_s'] / cases * 1e6:>14.1f}")
+    print(f"{'picked outright':<28}{'-':>12}{totals['picked'] / cases:>14.1%}")
+    print(f"{'  of which correct':<28}{'-':>12}{totals['picked_right'] / (totals['picked'] or 1):>14.1%}")
+    print(f"{f'target in top {args.top_n}':<28}{'-':>12}{totals['top_k'] / cases:>14.1%}")
+    print(f"{'item_detail bytes per item':<28}{totals['full_bytes'] / cases:>12.0f}{totals['trimmed_bytes'] / cases:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Measure worker boot time: importing the app and answering the first health check.
+
+Each sample runs in a fresh interpreter so that module import caches do not
+hide the cost. The first task still pays for crewai and telemetry; that cost is
+reported separately with --first-task.
+
+    python benchmarks/bench_startup.py [--runs 5] [--first-task]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOOT_SNIPPET = """
+import time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/')
+assert response.status_code == 200
+answered = time.perf_counter()
+print(imported - started, answered - started)
+"""
+
+FIRST_TASK_SNIPPET = """
+import time
+import app
+started = time.perf_counter()
+app.get_crew_manager()
+print(time.perf_counter() - started)
+"""
+
+
+def run(snippet):
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", "sqlite://")
+    output = subprocess.run([sys.executable, "-c", snippet], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return [float(value) for value in output.split()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--first-task", action="store_true")
+    args = parser.parse_args()
+
+    samples = [run(BOOT_SNIPPET) for _ in range(args.runs)]
+    print(f"import app:         median={statistics.median(s[0] for s in samples):.3f}s")
+    print(f"first health check: median={statistics.median(s[1] for s in samples):.3f}s")
+    if args.first_task:
+        first = [run(FIRST_TASK_SNIPPET)[0] for _ in range(args.runs)]
+        print(f"crew manager init:  median={statistics.median(first):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import job_lease
+from database import db
+from models import Task
+from tools import tmapi
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = 'cache_warmer'
+
+# Report of the most recent warming run in this process; /api/metrics serves the one stored in job_run
+last_report: Optional[Dict] = None
+
+
+def _normalize(description: str) -> str:
+    return re.sub(r'\s+', ' ', (description or '').strip().lower())
+
+
+def parse_hours(spec: str) -> Tuple[int, int]:
+    """Parse an off-peak window such as "2-6" (UTC hours, end exclusive, may wrap midnight)"""
+    start, end = (int(part) for part in spec.split('-', 1))
+    return start % 24, end % 24
+
+
+def in_window(hour: int, window: Tuple[int, int]) -> bool:
+    start, end = window
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+class CacheWarmer:
+    """Refresh the tmapi response cache for the most requested queries and items.
+
+    Queries and items are mined from recent tasks: the translated keyword stored
+    in task_metadata['pipeline'] and the item_ids in each task result. Each run
+    issues at most ``budget`` API calls and reports how much of the hot set is
+    covered by a fresh cache entry afterwards.
+    """
+
+    def __init__(self, budget: Optional[int] = None, lookback_days: Optional[int] = None,
+                 top_queries: Optional[int] = None, top_items: Optional[int] = None,
+                 min_age: Optional[float] = None):
+        self.budget = budget if budget is not None else int(os.environ.get("CACHE_WARMER_BUDGET", "200"))
+        self.lookback_days = lookback_days if lookback_days is not None else int(
+            os.environ.get("CACHE_WARMER_LOOKBACK_DAYS", "7"))
+        self.top_queries = top_queries if top_queries is not None else int(
+            os.environ.get("CACHE_WARMER_TOP_QUERIES", "50"))
+        self.top_items = top_items if top_items is not None else int(
+            os.environ.get("CACHE_WARMER_TOP_ITEMS", "200"))
+        # Entries younger than this are left alone; by default anything past half its TTL is refreshed
+        self.min_age = min_age if min_age is not None else float(
+            os.environ.get("CACHE_WARMER_MIN_AGE", tmapi.CACHE_TTL / 2))
+
+    def mine(self) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]], int]:
+        """Return (keyword, count) and (item_id, count) lists plus the number of unresolved queries"""
+        since = datetime.utcnow() - timedelta(days=self.lookback_days)
+        rows = (Task.query
+                .filter(Task.created_at >= since)
+                .with_entities(Task.description, Task.task_metadata, Task.result)
+                .order_by(Task.created_at)
+                .yield_per(500))
+
+        description_counts = Counter()
+        keywords = {}
+        item_counts = Counter()
+        for description, metadata, result in rows:
+            normalized = _normalize(description)
+            description_counts[normalized] += 1
+            keyword = ((metadata or {}).get('pipeline') or {}).get('keyword')
+            if keyword:
+                keywords[normalized] = keyword
+
+            if result:
+                try:
+                    items = json.loads(result).get('items', [])
+                except (json.JSONDecodeError, AttributeError):
+                    items = []
+                for item in items:
+                    if isinstance(item, dict) and item.get('item_id'):
+                        item_counts[str(item['item_id'])] += 1
+
+        keyword_counts = Counter()
+        unresolved = 0
+        for description, count in description_counts.most_common():
+            if description in keywords:
+                keyword_counts[keywords[description]] += count
+            else:
+                unresolved += 1
+
+        return (keyword_counts.most_common(self.top_queries),
+                item_counts.most_common(self.top_items),
+                unresolved)
+
+    def coverage(self, queries: List[Tuple[str, int]], items: List[Tuple[str, int]]) -> Dict:
+        """Fraction of hot queries and items, plain and weighted by demand, with a fresh cache entry"""
+        def measure(entries, cache_file):
+            if not entries:
+                return {'entries': 0, 'fresh': None, 'weighted': None}
+            fresh = [(key, count) for key, count in entries if tmapi.is_fresh(cache_file(key))]
+            total = sum(count for _, count in entries)
+            return {
+                'entries': len(entries),
+                'fresh': round(len(fresh) / len(entries), 4),
+                'weighted': round(sum(count for _, count in fresh) / total, 4),
+            }
+
+        return {
+            'queries': measure(queries, tmapi.search_cache_file),
+            'items': measure(items, tmapi.detail_cache_file),
+        }
+
+    def run(self) -> Dict:
+        """Refresh stale hot entries within the API budget and return a report"""
+        global last_report
+        started = time.perf_counter()
+        report = {'started_at': datetime.utcnow().isoformat(), 'budget': self.budget}
+
+        queries, items, unresolved = self.mine()
+        report['unresolved_queries'] = unresolved
+        report['coverage_before'] = self.coverage(queries, items)
+
+        if tmapi.is_mock_mode() or not os.environ.get("TMAPI_TOKEN"):
+            reason = 'mock mode' if tmapi.is_mock_mode() else 'API token not configured'
+            logger.info(f"Cache warmer skipped: {reason}")
+            report.update(skipped=reason, api_calls=0, refreshed={'queries': 0, 'items': 0}, errors=0)
+        else:
+            calls = errors = 0
+            refreshed = {'queries': 0, 'items': 0}
+            work = ([('queries', key, tmapi.search_cache_file, tmapi.fetch_search) for key, _ in queries]
+                    + [('items', key, tmapi.detail_cache_file, tmapi.fetch_item_detail) for key, _ in items])
+            for kind, key, cache_file, fetch in work:
+                if calls >= self.budget:
+                    break
+                if tmapi.is_fresh(cache_file(key), max_age=self.min_age):
+                    continue
+                calls += 1
+                try:
+                    data = fetch(key, refresh=True)
+                    # A stale response means tmapi's breaker is open and nothing was refreshed
+                    if data.get('code') == 200 and not data.get('stale'):
+                        refreshed[kind] += 1
+                    else:
+                        errors += 1
+                except Exception as e:
+                    logger.warning(f"Cache warmer failed to refresh {kind} {key}: {str(e)}")
+                    errors += 1
+            report.update(api_calls=calls, refreshed=refreshed, errors=errors)
+
+        report['coverage'] = self.coverage(queries, items)
+        report['duration'] = round(time.perf_counter() - started, 3)
+        logger.info(f"Cache warmer finished: {report['api_calls']} API calls, coverage {report['coverage']}")
+        last_report = report
+        try:
+            job_lease.save_report(JOB_NAME, report)
+        except Exception as e:
+            logger.warning(f"Failed to store cache warmer report: {str(e)}")
+            db.session.rollback()
+        return report
+
+
+def start_scheduler(app, interval: float = 300):
+    """Run the cache warmer once a day inside the CACHE_WARMER_HOURS UTC window.
+
+    Every gunicorn worker of every instance runs this loop, but only the one
+    that claims the day's job_run row warms the cache, so the API budget is
+    spent once per day. Alternatively leave CACHE_WARMER_ENABLED unset and run
+    `flask warm-cache` from cron.
+    """
+    window = parse_hours(os.environ.get("CACHE_WARMER_HOURS", "2-6"))
+    state = {'last_run': None}
+
+    def loop():
+        while True:
+            now = datetime.utcnow()
+            if in_window(now.hour, window) and state['last_run'] != now.date():
+                state['last_run'] = now.date()
+                with app.app_context():
+                    try:
+                        if job_lease.claim_daily(JOB_NAME, now.date()):
+                            CacheWarmer().run()
+                        else:
+                            logger.info("Cache warmer already ran on another worker today")
+                    except Exception as e:
+                        logger.error(f"Cache warmer run failed: {str(e)}")
+                        db.session.rollback()
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="cache-warmer")
+    thread.daemon = True
+    thread.start()
+    logger.info(f"Cache warmer scheduled for {window[0]:02d}:00-{window[1]:02d}:00 UTC")
+    return thread
@@ -0,0 +1,227 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+# CIRCUIT_BREAKER_ENABLED=false lets every call through
+ENABLED = os.environ.get("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an upstream whose breaker is open"""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"{name} is temporarily unavailable (circuit open, retry in {retry_after:.0f}s)")
+
+
+class CircuitBreaker:
+    """Failure-rate and latency circuit breaker shared by every thread calling one endpoint.
+
+    Calls are recorded in a sliding window of `window` seconds. Once it holds at
+    least min_calls calls, the breaker opens when the share of failed calls
+    reaches failure_rate or the share of calls slower than slow_call_seconds
+    reaches slow_rate. While open, calls fail immediately with CircuitOpenError.
+    After open_seconds the breaker is half-open and lets half_open_probes calls
+    through: if they all succeed quickly it closes, otherwise it opens again.
+    Exceptions listed in `excluded` (such as a cancelled task) are not counted;
+    with is_failure, other exceptions for which it returns False (such as a
+    client error caused by the caller's own input) count as successful calls.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, slow_rate: float = 0.5,
+                 slow_call_seconds: float = 10.0, min_calls: int = 5, window: float = 60.0,
+                 open_seconds: float = 30.0, half_open_probes: int = 1,
+                 excluded: Tuple[Type[BaseException], ...] = (),
+                 is_failure: Optional[Callable[[BaseException], bool]] = None):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.excluded = excluded
+        self.is_failure = is_failure
+
+        self._lock = threading.Lock()
+        self._calls = deque()  # (finished_at, failed, slow)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_results = []
+        self._stats = {'calls': 0, 'failures': 0, 'slow_calls': 0, 'rejected': 0, 'fallbacks': 0, 'opened': 0}
+        self._last_failure: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+            self._probe_results = []
+            logger.info("Circuit %s is half-open, probing", self.name)
+        return self._state
+
+    def allow(self):
+        """Reserve a call or raise CircuitOpenError; every allowed call must be recorded"""
+        if not ENABLED:
+            return
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return
+            self._stats['rejected'] += 1
+            retry_after = max(0.0, self.open_seconds - (now - self._opened_at)) if state == OPEN else 1.0
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record(self, duration: float, error: Optional[BaseException] = None):
+        """Record the outcome of an allowed call"""
+        if not ENABLED:
+            return
+        failed = error is not None
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            now = time.monotonic()
+            self._stats['calls'] += 1
+            self._stats['failures'] += failed
+            self._stats['slow_calls'] += slow
+            if failed:
+                self._last_failure = f"{type(error).__name__}: {error}"
+
+            if self._state == HALF_OPEN:
+                self._probe_results.append(failed or slow)
+                if failed or slow:
+                    self._open(now, "probe failed" if failed else f"probe took {duration:.1f}s")
+                elif len(self._probe_results) >= self.half_open_probes:
+                    self._state = CLOSED
+                    self._calls.clear()
+                    logger.info("Circuit %s closed", self.name)
+                return
+            if self._state == OPEN:
+                # A call allowed before the breaker opened; it no longer counts
+                return
+
+            self._calls.append((now, failed, slow))
+            while self._calls and now - self._calls[0][0] > self.window:
+                self._calls.popleft()
+            if len(self._calls) < self.min_calls:
+                return
+            failures = sum(1 for _, f, _ in self._calls if f)
+            slow_calls = sum(1 for _, _, s in self._calls if s)
+            if failures / len(self._calls) >= self.failure_rate:
+                self._open(now, f"{failures}/{len(self._calls)} calls failed")
+            elif slow_calls / len(self._calls) >= self.slow_rate:
+                self._open(now, f"{slow_calls}/{len(self._calls)} calls slower than {self.slow_call_seconds}s")
+
+    def release(self):
+        """Give back a reserved call that ended with an excluded exception"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > len(self._probe_results):
+                self._probes -= 1
+
+    def _open(self, now: float, reason: str):
+        self._state = OPEN
+        self._opened_at = now
+        self._calls.clear()
+        self._stats['opened'] += 1
+        logger.warning("Circuit %s opened for %ss: %s", self.name, self.open_seconds, reason)
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Call fn through the breaker"""
+        self.allow()
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except self.excluded:
+            self.release()
+            raise
+        except Exception as e:
+            failed = self.is_failure is None or self.is_failure(e)
+            self.record(time.monotonic() - started, e if failed else None)
+            raise
+        self.record(time.monotonic() - started)
+        return result
+
+    def record_fallback(self):
+        """Count a response served from a fallback while the breaker was open"""
+        with self._lock:
+            self._stats['fallbacks'] += 1
+
+    def reset(self):
+        with self._lock:
+            self._state = CLOSED
+            self._calls.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            calls = len(self._calls)
+            return {
+                **self._stats,
+                'state': state,
+                'window_calls': calls,
+                'window_failure_rate': round(sum(1 for _, f, _ in self._calls if f) / calls, 4) if calls else None,
+                'window_slow_rate': round(sum(1 for _, _, s in self._calls if s) / calls, 4) if calls else None,
+                'retry_after': round(max(0.0, self.open_seconds - (now - self._opened_at)), 1) if state == OPEN else None,
+                'last_failure': self._last_failure,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get(name: str, excluded: Tuple[Type[BaseException], ...] = (),
+        is_failure: Optional[Callable[[BaseException], bool]] = None, **defaults) -> CircuitBreaker:
+    """Return the process-wide breaker for an endpoint, creating it on first use.
+
+    Thresholds come from the CIRCUIT_* environment variables, overridden per
+    endpoint by its name (CIRCUIT_LLM_SLOW_CALL_SECONDS for "llm"); keyword
+    arguments set an endpoint's defaults, e.g. slow_call_seconds=60.
+    """
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            prefix = 'CIRCUIT_' + name.upper().replace('.', '_') + '_'
+
+            def setting(option, default):
+                key = option.upper()
+                default = os.environ.get('CIRCUIT_' + key, default) if option not in defaults else defaults[option]
+                return float(os.environ.get(prefix + key, default))
+
+            breaker = _breakers[name] = CircuitBreaker(
+                name,
+                failure_rate=setting('failure_rate', '0.5'),
+                slow_rate=setting('slow_rate', '0.5'),
+                slow_call_seconds=setting('slow_call_seconds', '10'),
+                min_calls=int(setting('min_calls', '5')),
+                window=setting('window', '60'),
+                open_seconds=setting('open_seconds', '30'),
+                half_open_probes=int(setting('half_open_probes', '1')),
+                excluded=excluded,
+                is_failure=is_failure,
+            )
+        return breaker
+
+
+def stats() -> Dict:
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {'enabled': ENABLED, 'breakers': {breaker.name: breaker.stats() for breaker in breakers}}
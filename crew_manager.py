@@ -2,38 +2,48 @@ import logging
 import os
 import yaml
 import json
-from crewai import Task as CrewTask, Agent, Crew
+import random
 from tasks import TaskQueue
 from database import db
-from tools.search_1688 import search1688, item_detail
+from fast_pipeline import FastPipeline
+import llm_batcher
+import sku_matcher
+import task_control
+import task_profiler
+import title_memo
+import log_pipeline
 from datetime import datetime
 import uuid
 import re
 from collections import defaultdict
-import agentops
+from typing import Dict, Optional
+import telemetry
 
 # Set up logging
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 # Create logs directory if it doesn't exist
 if not os.path.exists('logs'):
     os.makedirs('logs')
 
+PIPELINE_MODES = ('crew', 'fast')
+
+# Translate crew queries through the shared LLM batcher instead of the translation agent
+CREW_PRETRANSLATE = os.environ.get("CREW_PRETRANSLATE", "true").lower() == "true"
+
+# Share of crew runs that print verbose agent traces; every run still stores its steps in the task log
+CREW_VERBOSE_SAMPLE_RATE = float(os.environ.get("CREW_VERBOSE_SAMPLE_RATE", "0.1"))
+
 class CrewManager:
     def __init__(self):
         self.task_queue = TaskQueue()
         self.api_key = os.environ.get("OPENAI_API_KEY")
+        self.fast_pipeline = FastPipeline()
         self.task_logs = defaultdict(list)
         self.task_metadata = {}
 
-        # Initialize AgentOps with API key
-        agentops_api_key = os.environ.get("AGENTOPS_API_KEY")
-        if not agentops_api_key:
-            raise ValueError("AGENTOPS_API_KEY is required")
-
-        # Simple AgentOps initialization
-        agentops.init(agentops_api_key)
+        # AgentOps is optional and initializes in the background
+        telemetry.init_telemetry()
 
         # Load configurations
         try:
@@ -43,12 +53,15 @@ class CrewManager:
                 self.task_configs = yaml.safe_load(f)
             logger.debug("Configuration files loaded successfully")
         except Exception as e:
-            logger.error(f"Error loading configuration files: {str(e)}")
+            logger.error("Error loading configuration files: %s", e)
             raise
 
-    def create_agent(self, agent_name, config):
+    def create_agent(self, agent_name, config, verbose=False):
         """Create a CrewAI agent from configuration"""
-        logger.debug(f"Creating agent: {agent_name}")
+        from crewai import Agent
+        from tools.search_1688 import search1688, item_detail, search_local_catalog
+
+        logger.debug("Creating agent: %s", agent_name)
 
         # Define tool documentation for search1688
         search_tool_docs = """
@@ -65,7 +78,7 @@ class CrewManager:
         tools = []
         if agent_name == "search_expert":
             search1688.description = search_tool_docs
-            tools = [search1688]
+            tools = [search_local_catalog, search1688]
         elif agent_name == "detail_extraction_agent":
             tools = [item_detail]
 
@@ -73,7 +86,7 @@ class CrewManager:
             role=config['role'],
             goal=config['goal'].format(query="{query}"),
             backstory=config['backstory'],
-            verbose=True,
+            verbose=verbose,
             allow_delegation=False,
             tools=tools,
             llm_config={
@@ -86,48 +99,219 @@ class CrewManager:
 
         return agent
 
-    def process_task(self, task_id: str, query: str):
+    def process_task(self, task_id: str, query: str, mode: str = 'crew', previous: Optional[Dict] = None,
+                     profile_hz: Optional[float] = None):
+        """Process a task using CrewAI with the configured agents, or the fast pipeline.
+
+        Mode 'refresh' re-runs the finished task `previous` (a task dict) instead.
+        The task runs under a deadline and can be cancelled; both are checked
+        cooperatively between steps and before every tool call. With profile_hz
+        the task's threads are sampled and the profile is stored with the task.
+        """
+        context = task_control.start(task_id, poll=lambda: self.task_queue.get_task_status(task_id))
+        profiler = task_profiler.SamplingProfiler(lambda: context.threads, profile_hz).start() if profile_hz else None
+        try:
+            if mode == 'refresh':
+                return self.process_task_refresh(task_id, query, previous)
+            if mode == 'fast':
+                return self.process_task_fast(task_id, query)
+            return self.process_task_crew(task_id, query)
+        except task_control.TaskAborted as e:
+            logger.warning("Task %s stopped after %.1fs: %s", task_id, context.elapsed(), e)
+            self.abort_task(task_id, query, context, e)
+        finally:
+            if profiler:
+                self.save_profile(task_id, profiler.stop())
+            task_control.finish(task_id)
+            log_pipeline.close_task_log(task_id)
+
+    def save_profile(self, task_id: str, profile: Dict):
+        logger.info("Task %s profile: %d samples in %ss, categories %s", task_id, profile['samples'],
+                    profile['duration_s'], {name: c['seconds'] for name, c in profile['categories'].items()})
+        try:
+            self.task_queue.save_profile(task_id, profile)
+        except Exception as e:
+            logger.error("Failed to store profile of task %s: %s", task_id, e)
+            db.session.rollback()
+
+    def process_task_crew(self, task_id: str, query: str):
         """Process a task using CrewAI with the configured agents"""
+        from crewai import Crew
+
+        context = task_control.current()
         try:
-            # Create agents
+            # A batched translation replaces the translation task when available
+            context.enter_stage('translation_task')
+            analysis = self.pretranslate(query)
+            keyword = analysis['keyword'] if analysis else None
+            task_configs = {name: config for name, config in self.task_configs.items()
+                            if not (keyword and name == 'translation_task')}
+
+            # Create agents; verbose traces are sampled
+            verbose = random.random() < CREW_VERBOSE_SAMPLE_RATE
             agents = {}
+            used_agents = {config['agent'] for config in task_configs.values()}
             for name, config in self.agent_configs.items():
-                agent = self.create_agent(name, config)
+                if name not in used_agents:
+                    continue
+                agent = self.create_agent(name, config, verbose)
                 agents[name] = agent
 
             # Create tasks
             tasks = []
             task_ids = []
-            for task_name, config in self.task_configs.items():
+            for task_name, config in task_configs.items():
                 agent = agents[config['agent']]
-                task, tracking_id = self.create_task(task_name, config, agent, query)
+                task, tracking_id = self.create_task(task_name, config, agent, query, keyword)
                 tasks.append(task)
                 task_ids.append(tracking_id)
 
+            # Stages follow the crew tasks; the deadline is checked after every agent step
+            stages = iter(task_configs)
+
+            def on_step(step):
+                tool = getattr(step, 'tool', None)
+                if tool:
+                    logger.info("Agent used tool %s", tool, extra={
+                        'event': 'agent_step',
+                        'tool': tool,
+                        'tool_input': getattr(step, 'tool_input', None),
+                        'tool_output': getattr(step, 'result', None)
+                    })
+                else:
+                    logger.info("Agent finished: %s", getattr(step, 'output', step), extra={'event': 'agent_finish'})
+                context.check()
+
+            def on_task_done(output):
+                logger.info("Crew task %s finished", context.stage, extra={'event': 'task_done'})
+                context.partial_result = output.raw
+                next_stage = next(stages, None)
+                if next_stage:
+                    context.enter_stage(next_stage)
+
             # Create and run crew
             crew = Crew(
                 agents=list(agents.values()),
                 tasks=tasks,
-                verbose=True,
-                process_name=f"Task {task_id}"
+                verbose=verbose,
+                process_name=f"Task {task_id}",
+                step_callback=on_step,
+                task_callback=on_task_done
             )
+            context.enter_stage(next(stages))
+
+            # Execute tasks; the item_detail tool ranks variants against the query
+            constraints = sku_matcher.parse_constraints(
+                query, keyword or '', analysis['variant_terms'] if analysis else ())
+            with sku_matcher.use_constraints(constraints):
+                result = crew.kickoff()
 
-            # Execute tasks
-            result = crew.kickoff()
+            # Keep the translated keyword so the task can be reused by the cache warmer
+            tasks_output = getattr(result, 'tasks_output', None) or []
+            if not keyword and tasks_output and tasks_output[0].raw:
+                keyword = self._strip_markdown(tasks_output[0].raw).strip('"\'')
+            metadata = {'pipeline': {'keyword': keyword}} if keyword else None
 
             # Store results
-            self.update_task_completion(task_id, task_ids, result, query)
+            self.update_task_completion(task_id, task_ids, result, query, metadata)
 
             # End AgentOps session with success
-            agentops.end_session('Success')
+            telemetry.end_session('Success')
+
+        except task_control.TaskAborted:
+            telemetry.end_session('Indeterminate')
+            raise
+        except Exception as e:
+            logger.error("Task processing error: %s", e)
+            telemetry.end_session('Error')
+            raise
 
+    def pretranslate(self, query: str):
+        """Analyze the query through the shared LLM batcher; None leaves translation to the translation agent"""
+        if not CREW_PRETRANSLATE:
+            return None
+        try:
+            return llm_batcher.analyze_query(query)
+        except task_control.TaskAborted:
+            raise
         except Exception as e:
-            logger.error(f"Task processing error: {str(e)}")
-            agentops.end_session('Error')
+            logger.warning("Batched translation failed, using the translation agent: %s", e)
+            return None
+
+    def process_task_fast(self, task_id: str, query: str):
+        """Process a task with the deterministic fast pipeline instead of the agent crew"""
+        try:
+            result, stats = self.fast_pipeline.run(query)
+        except task_control.TaskAborted as e:
+            # Logged and stored by process_task; a cancellation is not an error
+            logger.info("Fast pipeline stopped at %s: %s", e.stage, e)
             raise
+        except Exception as e:
+            logger.error("Fast pipeline error: %s", e)
+            raise
+
+        logger.info("Fast pipeline finished task %s in %ss", task_id, stats['timings']['total'])
+        self.task_queue.update_task(
+            task_id=task_id,
+            status='completed',
+            result=json.dumps(result, ensure_ascii=False),
+            metadata={'pipeline': stats}
+        )
+
+    def process_task_refresh(self, task_id: str, query: str, previous: Dict):
+        """Refresh a finished task with the fast pipeline, reusing its keyword and candidates"""
+        try:
+            previous_items = json.loads(previous.get('result') or '{}').get('items') or []
+        except (json.JSONDecodeError, AttributeError):
+            previous_items = []
+        pipeline = (previous.get('metadata') or {}).get('pipeline') or {}
 
-    def create_task(self, task_name, config, agent, query):
+        result, stats = self.fast_pipeline.refresh(query, pipeline, previous_items)
+        changes = stats['changes']
+        logger.info("Refreshed task %s as %s in %ss: %d added, %d removed, %d price changes, %d details fetched",
+                    previous['id'], task_id, stats['timings']['total'], len(changes['added']),
+                    len(changes['removed']), len(changes['price_changed']), changes['details_fetched'])
+        self.task_queue.update_task(
+            task_id=task_id,
+            status='completed',
+            result=json.dumps(result, ensure_ascii=False),
+            metadata={'pipeline': stats}
+        )
+
+    def abort_task(self, task_id: str, query: str, context, error):
+        """Store the best partial result of a cancelled or timed-out task"""
+        partial = context.partial_result
+        if isinstance(partial, str):
+            # Crew tasks leave the raw output of the last finished crew task
+            try:
+                items = self._extract_json(self._strip_markdown(partial)).get('items')
+            except (json.JSONDecodeError, AttributeError):
+                items = None
+            partial = {'items': items} if isinstance(items, list) else {'raw_output': partial}
+        result = {
+            **(partial or {}),
+            'error': str(error),
+            'timestamp': datetime.utcnow().isoformat()
+        }
+        result.setdefault('metadata', {'query': query, 'timestamp': result['timestamp']})
+        abort = {
+            'reason': 'cancelled' if isinstance(error, task_control.TaskCancelled) else 'deadline',
+            'stage': error.stage,
+            'elapsed': round(context.elapsed(), 2)
+        }
+
+        if isinstance(error, task_control.TaskCancelled):
+            # The cancel request already set the status; only attach the partial result
+            self.task_queue.transition(task_id, result=json.dumps(result, ensure_ascii=False),
+                                       metadata={'abort': abort}, from_status=('cancelled',))
+        else:
+            self.task_queue.update_task(task_id, 'failed', result=json.dumps(result, ensure_ascii=False),
+                                        metadata={'abort': abort})
+
+    def create_task(self, task_name, config, agent, query, keyword=None):
         """Create a CrewAI task from configuration"""
+        from crewai import Task as CrewTask
+
         task_tracking_id = str(uuid.uuid4())
 
         # Store task metadata
@@ -144,15 +328,19 @@ class CrewManager:
             "fields": config.get('output_format', {}).get('fields', {})
         }
 
+        description = config['description'].format(query=query)
+        if keyword and 'translation_task' in config.get('dependencies', []):
+            description += f'\nThe translated Chinese search query is: "{keyword}".'
+
         task = CrewTask(
-            description=config['description'].format(query=query),
+            description=description,
             expected_output=config['expected_output'],
             agent=agent
         )
 
         return task, task_tracking_id
 
-    def update_task_completion(self, task_id, task_ids, result, query):
+    def update_task_completion(self, task_id, task_ids, result, query, metadata=None):
         """Update task completion status and store results"""
         try:
             # Format the result
@@ -169,15 +357,24 @@ class CrewManager:
                 except json.JSONDecodeError:
                     pass
 
+            # English titles come from the title memo rather than the json conversion agent.
+            # If the task is stopped while translating, abort_task keeps the crew's result.
+            if isinstance(formatted_result, dict) and isinstance(formatted_result.get('items'), list):
+                task_control.set_partial(formatted_result)
+                title_memo.translate(formatted_result['items'])
+
             # Update task queue
             self.task_queue.update_task(
                 task_id=task_id,
                 status='completed',
-                result=json.dumps(formatted_result, ensure_ascii=False)
+                result=json.dumps(formatted_result, ensure_ascii=False),
+                metadata=metadata
             )
 
+        except task_control.TaskAborted:
+            raise
         except Exception as e:
-            logger.error(f"Error updating task completion: {str(e)}")
+            logger.error("Error updating task completion: %s", e)
             self.task_queue.update_task(
                 task_id=task_id,
                 status='failed',
@@ -187,8 +384,8 @@ class CrewManager:
     def format_result(self, result, query):
         """Format the CrewAI output into our expected JSON structure"""
         try:
-            logger.debug(f"Raw result type: {type(result)}")
-            logger.debug(f"Raw result: {result}")
+            logger.debug("Raw result type: %s", type(result))
+            logger.debug("Raw result: %s", result)
             
             # If this is not the final task result, return it as is
             if isinstance(result.raw, str) and "metadata" not in result.raw:
@@ -197,10 +394,10 @@ class CrewManager:
 
             # Convert result to string and strip markdown
             result_str = str(result.raw if hasattr(result, 'raw') else result)
-            logger.debug(f"After string conversion: {result_str}")
+            logger.debug("After string conversion: %s", result_str)
             
             result_str = self._strip_markdown(result_str)
-            logger.debug(f"After markdown strip: {result_str}")
+            logger.debug("After markdown strip: %s", result_str)
             
             try:
                 # If result already contains items, use them directly
@@ -219,14 +416,14 @@ class CrewManager:
                     }
                 }
             except json.JSONDecodeError as je:
-                logger.error(f"Error parsing result JSON: {result_str}")
+                logger.error("Error parsing result JSON: %s", result_str)
                 return {
                     "error": "Invalid JSON format",
                     "raw_output": result_str,
                     "timestamp": datetime.utcnow().isoformat()
                 }
         except Exception as e:
-            logger.error(f"Error formatting result: {str(e)}")
+            logger.error("Error formatting result: %s", e)
             return {
                 "error": str(e),
                 "raw_output": str(result),
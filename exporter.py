@@ -0,0 +1,167 @@
+import io
+import json
+import logging
+import re
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+
+from sqlalchemy import select
+
+from database import db
+from models import Task, TaskArchive, decompress_result
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('ndjson', 'parquet')
+
+# Flattened row layout: one row per result item
+COLUMNS = [
+    ('task_id', 'string'),
+    ('user_id', 'string'),
+    ('status', 'string'),
+    ('query', 'string'),
+    ('created_at', 'timestamp'),
+    ('completed_at', 'timestamp'),
+    ('rank', 'int'),
+    ('item_id', 'string'),
+    ('title', 'string'),
+    ('english_title', 'string'),
+    ('price', 'float'),
+    ('product_url', 'string'),
+    ('repurchase_rate', 'float'),
+    ('item_score', 'float'),
+    ('orders_count', 'int'),
+    ('props_names', 'string'),
+]
+
+
+def _number(value, cast=float):
+    if value is None or isinstance(value, (int, float)):
+        return cast(value) if value is not None else None
+    match = re.search(r'-?\d+(?:\.\d+)?', str(value))
+    return cast(float(match.group())) if match else None
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def iter_task_rows(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                   user_id: Optional[str] = None, status: Optional[str] = None,
+                   batch_size: int = 500) -> Iterator[tuple]:
+    """Iterate matching tasks with a server-side cursor, batch_size rows at a time"""
+    stmt = (select(Task.id, Task.user_id, Task.status, Task.description,
+                   Task.created_at, Task.completed_at, Task.result, TaskArchive.result)
+            .outerjoin(TaskArchive, TaskArchive.task_id == Task.id))
+    if start:
+        stmt = stmt.where(Task.created_at >= start)
+    if end:
+        stmt = stmt.where(Task.created_at < end)
+    if user_id:
+        stmt = stmt.where(Task.user_id == user_id)
+    if status:
+        stmt = stmt.where(Task.status == status)
+    stmt = stmt.order_by(Task.created_at).execution_options(yield_per=batch_size)
+    yield from db.session.execute(stmt)
+
+
+def flatten_task(row) -> Iterator[Dict]:
+    """Yield one flat record per item in the task result"""
+    task_id, user_id, status, description, created_at, completed_at, result, archived = row
+    if archived is not None:
+        result = decompress_result(archived)
+    if not result:
+        return
+    try:
+        items = json.loads(result).get('items', [])
+    except (json.JSONDecodeError, AttributeError):
+        return
+
+    for rank, item in enumerate(items, start=1):
+        if not isinstance(item, dict):
+            continue
+        yield {
+            'task_id': task_id,
+            'user_id': user_id,
+            'status': status,
+            'query': description,
+            'created_at': created_at,
+            'completed_at': completed_at,
+            'rank': rank,
+            'item_id': _text(item.get('item_id')),
+            'title': _text(item.get('title')),
+            'english_title': _text(item.get('english_title')),
+            'price': _number(item.get('price')),
+            'product_url': _text(item.get('product_url')),
+            'repurchase_rate': _number(item.get('repurchase_rate')),
+            'item_score': _number(item.get('item_score')),
+            'orders_count': _number(item.get('orders_count'), int),
+            'props_names': _text(item.get('props_names')),
+        }
+
+
+def iter_records(**filters) -> Iterator[Dict]:
+    for row in iter_task_rows(**filters):
+        yield from flatten_task(row)
+
+
+def stream_ndjson(records: Iterator[Dict]) -> Iterator[str]:
+    """Serialize records as newline-delimited JSON, one line at a time"""
+    for record in records:
+        for key in ('created_at', 'completed_at'):
+            if record[key] is not None:
+                record[key] = record[key].isoformat()
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands written bytes back to the caller in chunks"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_parquet(records: Iterator[Dict], chunk_rows: int = 10000) -> Iterator[bytes]:
+    """Serialize records as Parquet, emitting one row group per chunk_rows records.
+
+    Requires pyarrow, which is an optional dependency.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {'string': pa.string(), 'int': pa.int64(), 'float': pa.float64(), 'timestamp': pa.timestamp('us')}
+    schema = pa.schema([(name, types[kind]) for name, kind in COLUMNS])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+
+    def write(batch):
+        writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= chunk_rows:
+            write(batch)
+            batch = []
+            yield sink.drain()
+    if batch:
+        write(batch)
+    writer.close()
+    yield sink.drain()
@@ -0,0 +1,276 @@
+import logging
+import math
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import llm_batcher
+import sku_matcher
+import task_control
+import title_memo
+from tools import tmapi
+from tools.tmapi import search_items, get_item_detail
+
+logger = logging.getLogger(__name__)
+
+
+def _to_float(value, default: float = 0.0) -> float:
+    """Parse numbers such as "12.00", "100%" or "5.0" returned by tmapi"""
+    if value is None:
+        return default
+    match = re.search(r'-?\d+(?:\.\d+)?', str(value))
+    return float(match.group()) if match else default
+
+
+def _bigrams(text: str) -> set:
+    text = re.sub(r'\s+', '', text or '').lower()
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def relevance(keyword: str, title: str) -> float:
+    """Fraction of the keyword's character bigrams found in the title"""
+    wanted = _bigrams(keyword)
+    if not wanted:
+        return 0.0
+    return len(wanted & _bigrams(title)) / len(wanted)
+
+
+class FastPipeline:
+    """Deterministic alternative to the agent crew for simple product queries.
+
+    A single LLM call translates the buyer query and names the wanted variant,
+    then search, detail lookups and ranking run directly in code, and result
+    titles are translated in one batched call. The result has the same shape as
+    the output of json_conversion_task.
+    """
+
+    def __init__(self, translate: bool = True):
+        self.translate = translate
+        self.candidate_count = int(os.environ.get("FAST_PIPELINE_CANDIDATES", "8"))
+        self.result_count = int(os.environ.get("FAST_PIPELINE_RESULTS", "5"))
+        self.max_workers = int(os.environ.get("FAST_PIPELINE_WORKERS", "8"))
+
+    def analyze_query(self, query: str) -> Dict:
+        """Translate the query and extract variant terms with one (batched) LLM call"""
+        return llm_batcher.analyze_query(query)
+
+    def run(self, query: str, analysis: Optional[Dict] = None) -> Tuple[Dict, Dict]:
+        """Run the pipeline and return the formatted result and run statistics"""
+        timings = {}
+        started = time.perf_counter()
+
+        task_control.enter_stage("analysis")
+        if analysis is None:
+            analysis = self.analyze_query(query)
+        timings["analysis"] = time.perf_counter() - started
+        keyword = analysis["keyword"]
+        logger.info("Fast pipeline query %r translated to %r", query, keyword)
+        constraints = sku_matcher.parse_constraints(query, keyword, analysis["variant_terms"])
+
+        stage_start = time.perf_counter()
+        task_control.enter_stage("search")
+        search_result = search_items(keyword)
+        if search_result.get("error") and not search_result.get("items"):
+            raise RuntimeError(f"Search failed: {search_result['error']}")
+        candidates = self.select_candidates(keyword, search_result.get("items", []))
+        timings["search"] = time.perf_counter() - stage_start
+        # Search results alone are the fallback if the task runs out of time
+        task_control.set_partial(self.format_result(query, self.rank(
+            keyword, [self.build_item(c, None, []) for c in candidates])[:self.result_count]))
+
+        stage_start = time.perf_counter()
+        task_control.enter_stage("detail")
+        details = self.fetch_details([c["item_id"] for c in candidates])
+        timings["detail"] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        task_control.enter_stage("ranking")
+        items = [self.build_item(c, details.get(str(c["item_id"])), constraints) for c in candidates]
+        items = self.rank(keyword, items)[:self.result_count]
+        result = self.format_result(query, items)
+        task_control.set_partial(result)
+        timings["ranking"] = time.perf_counter() - stage_start
+
+        if self.translate:
+            stage_start = time.perf_counter()
+            task_control.enter_stage("translation")
+            self.translate_titles(items)
+            timings["translation"] = time.perf_counter() - stage_start
+        timings["total"] = time.perf_counter() - started
+
+        stats = {
+            "keyword": keyword,
+            "variant_terms": analysis["variant_terms"],
+            "constraints": [c.describe() for c in constraints],
+            "candidates": [str(c["item_id"]) for c in candidates],
+            "timings": {k: round(v, 4) for k, v in timings.items()},
+        }
+        return result, stats
+
+    def refresh(self, query: str, previous: Dict, previous_items: List[Dict]) -> Tuple[Dict, Dict]:
+        """Re-run a finished task from its stored keyword and candidate set.
+
+        previous is the task's 'pipeline' metadata. A fresh search finds new and
+        dropped candidates; details are fetched only for items that are new or
+        whose cached detail is older than REFRESH_DETAIL_MAX_AGE, and English
+        titles are reused for items whose title did not change. The statistics
+        include a 'changes' report against the previous result.
+        """
+        timings = {}
+        started = time.perf_counter()
+        keyword = previous["keyword"]
+        variant_terms = previous.get("variant_terms") or []
+        constraints = sku_matcher.parse_constraints(query, keyword, variant_terms)
+        previous_candidates = [str(item_id) for item_id in previous.get("candidates")
+                               or [item["item_id"] for item in previous_items]]
+
+        task_control.enter_stage("search")
+        search_result = search_items(keyword, refresh=True)
+        if search_result.get("error") and not search_result.get("items"):
+            raise RuntimeError(f"Search failed: {search_result['error']}")
+        candidates = self.select_candidates(keyword, search_result.get("items", []))
+        candidate_ids = [str(c["item_id"]) for c in candidates]
+        timings["search"] = time.perf_counter() - started
+
+        stage_start = time.perf_counter()
+        task_control.enter_stage("detail")
+        max_age = float(os.environ.get("REFRESH_DETAIL_MAX_AGE", str(tmapi.CACHE_TTL)))
+        stale = [] if tmapi.is_mock_mode() else [
+            item_id for item_id in candidate_ids if not tmapi.is_fresh(tmapi.detail_cache_file(item_id), max_age)]
+        details = self.fetch_details([item_id for item_id in candidate_ids if item_id not in stale])
+        details.update(self.fetch_details(stale, refresh=True))
+        timings["detail"] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        task_control.enter_stage("ranking")
+        items = [self.build_item(c, details.get(str(c["item_id"])), constraints) for c in candidates]
+        items = self.rank(keyword, items)[:self.result_count]
+        result = self.format_result(query, items)
+        task_control.set_partial(result)
+        timings["ranking"] = time.perf_counter() - stage_start
+
+        known_titles = {(str(item.get("item_id")), item.get("title")): item.get("english_title")
+                        for item in previous_items if item.get("english_title")}
+        for item in items:
+            item["english_title"] = known_titles.get((item["item_id"], item["title"]))
+        untranslated = [item for item in items if not item["english_title"]]
+        if self.translate and untranslated:
+            stage_start = time.perf_counter()
+            task_control.enter_stage("translation")
+            self.translate_titles(untranslated)
+            timings["translation"] = time.perf_counter() - stage_start
+        timings["total"] = time.perf_counter() - started
+
+        stats = {
+            "keyword": keyword,
+            "variant_terms": variant_terms,
+            "constraints": [c.describe() for c in constraints],
+            "candidates": candidate_ids,
+            "timings": {k: round(v, 4) for k, v in timings.items()},
+            "changes": self.compare(previous_items, items),
+        }
+        stats["changes"].update({
+            "candidates_added": [i for i in candidate_ids if i not in previous_candidates],
+            "candidates_dropped": [i for i in previous_candidates if i not in candidate_ids],
+            "details_fetched": len(stale),
+            "details_reused": len(candidate_ids) - len(stale),
+            "titles_translated": sum(1 for item in untranslated if item["english_title"]),
+        })
+        return result, stats
+
+    @staticmethod
+    def compare(previous_items: List[Dict], items: List[Dict]) -> Dict:
+        """Items added to and removed from the result, and price and rank changes of the rest"""
+        before = {str(item.get("item_id")): (rank, item) for rank, item in enumerate(previous_items, 1)}
+        after = {item["item_id"]: (rank, item) for rank, item in enumerate(items, 1)}
+        changes = {"added": [i for i in after if i not in before],
+                   "removed": [i for i in before if i not in after],
+                   "price_changed": [], "rank_changed": []}
+        for item_id, (rank, item) in after.items():
+            if item_id not in before:
+                continue
+            old_rank, old_item = before[item_id]
+            old_price = _to_float(old_item.get("price"), None)
+            if old_price != item["price"]:
+                changes["price_changed"].append({"item_id": item_id, "old": old_price, "new": item["price"]})
+            if old_rank != rank:
+                changes["rank_changed"].append({"item_id": item_id, "old": old_rank, "new": rank})
+        return changes
+
+    @staticmethod
+    def format_result(query: str, items: List[Dict]) -> Dict:
+        """Wrap items in the json_conversion_task result shape"""
+        return {
+            "items": items,
+            "metadata": {
+                "query": query,
+                "timestamp": datetime.utcnow().isoformat()
+            }
+        }
+
+    def select_candidates(self, keyword: str, items: List[Dict]) -> List[Dict]:
+        """Drop promoted (p4p) items and keep the most promising search results"""
+        organic = [item for item in items if not item.get("is_p4p")]
+        organic.sort(key=lambda item: (
+            relevance(keyword, item.get("title", "")),
+            _to_float(item.get("orders_count")),
+            _to_float(item.get("item_score")),
+        ), reverse=True)
+        return organic[:self.candidate_count]
+
+    def fetch_details(self, item_ids: List[str], refresh: bool = False) -> Dict[str, Dict]:
+        """Fetch item details concurrently, keyed by item_id; refresh bypasses the response cache"""
+        if not item_ids:
+            return {}
+        fetch = task_control.bind(lambda item_id: get_item_detail(item_id, refresh=refresh))
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(item_ids))) as executor:
+            results = executor.map(fetch, item_ids)
+            return {str(item_id): detail for item_id, detail in zip(item_ids, results)}
+
+    def select_variant(self, detail: Optional[Dict],
+                       constraints: List[sku_matcher.Constraint]) -> Optional[Dict]:
+        """Pick the SKU best matching the buyer's constraints, preferring in-stock and cheaper SKUs"""
+        return sku_matcher.best_variant(detail, constraints)
+
+    def build_item(self, candidate: Dict, detail: Optional[Dict],
+                   constraints: List[sku_matcher.Constraint]) -> Dict:
+        """Merge a search candidate with its detail into the json_conversion_task item schema"""
+        sku = self.select_variant(detail, constraints)
+        price = _to_float(sku.get("sale_price")) if sku and sku.get("sale_price") else None
+        if price is None:
+            price = _to_float((detail or {}).get("price_info", {}).get("price") or candidate.get("price"))
+
+        return {
+            "item_id": str(candidate.get("item_id", "")),
+            "title": (detail or {}).get("title") or candidate.get("title", ""),
+            "price": price,
+            "product_url": candidate.get("product_url", ""),
+            "repurchase_rate": _to_float(candidate.get("repurchase_rate")),
+            "item_score": _to_float(candidate.get("item_score")),
+            "orders_count": int(_to_float(candidate.get("orders_count"))),
+            "props_names": sku.get("props_names", "") if sku else "",
+            "english_title": None,
+        }
+
+    def translate_titles(self, items: List[Dict]):
+        """Fill english_title in place from the title memo; only unknown titles go to the LLM"""
+        title_memo.translate(items)
+
+    def rank(self, keyword: str, items: List[Dict]) -> List[Dict]:
+        """Rank items by relevance, sales volume, item score and repurchase rate"""
+        if not items:
+            return []
+        max_orders = max(math.log1p(item["orders_count"]) for item in items) or 1.0
+
+        def score(item):
+            return (0.4 * relevance(keyword, item["title"])
+                    + 0.3 * math.log1p(item["orders_count"]) / max_orders
+                    + 0.2 * min(item["item_score"], 5.0) / 5.0
+                    + 0.1 * min(item["repurchase_rate"], 100.0) / 100.0)
+
+        return sorted(items, key=score, reverse=True)
@@ -0,0 +1,48 @@
+import logging
+import os
+import socket
+from datetime import date, datetime
+from typing import Dict, Optional
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+
+from database import db
+from models import JobRun
+
+logger = logging.getLogger(__name__)
+
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_daily(name: str, day: date) -> bool:
+    """Claim the run of job `name` for `day`; True for exactly one worker across all instances.
+
+    The claim is a conditional UPDATE of the job's job_run row, so every
+    gunicorn worker can poll it. A run that crashes is not retried that day.
+    """
+    if db.session.get(JobRun, name) is None:
+        try:
+            db.session.add(JobRun(name=name))
+            db.session.commit()
+        except IntegrityError:
+            # Another worker created the row first
+            db.session.rollback()
+    claimed = db.session.execute(
+        update(JobRun)
+        .where(JobRun.name == name, or_(JobRun.run_on.is_(None), JobRun.run_on < day))
+        .values(run_on=day, owner=OWNER, started_at=datetime.utcnow(), finished_at=None)
+    ).rowcount == 1
+    db.session.commit()
+    return claimed
+
+
+def save_report(name: str, report: Dict):
+    """Store the report of a finished run so every worker can serve it"""
+    db.session.merge(JobRun(name=name, finished_at=datetime.utcnow(), report=report))
+    db.session.commit()
+
+
+def last_report(name: str) -> Optional[Dict]:
+    job = db.session.get(JobRun, name)
+    return job.report if job else None
@@ -0,0 +1,297 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, Optional
+
+import circuit_breaker
+import task_control
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_PROMPT = """The buyer wants to purchase a product from 1688.com. This is the query they provided: "{query}".
+Evaluate the query and understand the buyer's intent. Then respond with a JSON object with two fields:
+- "keyword": a concise search query in Chinese suitable for effective searches on 1688.com.
+- "variant_terms": a list of short Chinese terms describing the product variant the buyer wants
+  (for example color, size, weight or material as they would appear in a 1688 SKU name). Use an empty list if none.
+Respond with the JSON object only."""
+
+BATCH_ANALYSIS_PROMPT = """Each entry of the JSON array below is a query a buyer wants to purchase on 1688.com.
+For every query, evaluate the buyer's intent and produce an object with two fields:
+- "keyword": a concise search query in Chinese suitable for effective searches on 1688.com.
+- "variant_terms": a list of short Chinese terms describing the product variant the buyer wants
+  (for example color, size, weight or material as they would appear in a 1688 SKU name). Use an empty list if none.
+Respond with a JSON array containing exactly one object per query, in the same order, and nothing else.
+
+{queries}"""
+
+BATCH_TITLE_PROMPT = """Translate each Chinese 1688.com product title in the JSON array below into a short, natural English product title.
+Respond with a JSON array of strings containing exactly one translation per title, in the same order, and nothing else.
+
+{titles}"""
+
+
+def _extract(text: str, opening: str, closing: str):
+    start_idx = text.find(opening)
+    end_idx = text.rfind(closing)
+    if start_idx < 0 or end_idx <= start_idx:
+        raise ValueError(f"LLM response contains no JSON: {text}")
+    return json.loads(text[start_idx:end_idx + 1])
+
+
+class MicroBatcher:
+    """Collect small uniform requests from concurrent callers into batches.
+
+    The first request of a batch waits at most ``max_wait`` seconds for others to
+    join; the batch is dispatched early once it holds ``max_batch`` requests.
+    ``handler`` receives the list of payloads and returns results in the same order;
+    an exception instance in place of a result fails only that request.
+    """
+
+    def __init__(self, name: str, handler: Callable[[List], List], max_wait: float = 0.02,
+                 max_batch: int = 16, max_in_flight: int = 4):
+        self.name = name
+        self.handler = handler
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=f"batch-{name}")
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'batches': 0, 'failed_batches': 0, 'max_batch_size': 0,
+                       'total_wait': 0.0, 'max_wait': 0.0}
+        self._thread = None
+
+    def submit(self, payload) -> Future:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._collect, name=f"batcher-{self.name}")
+                    self._thread.daemon = True
+                    self._thread.start()
+        future = Future()
+        self._queue.put((payload, future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        dispatched = time.perf_counter()
+        waits = [dispatched - submitted for _, _, submitted in batch]
+        with self._lock:
+            self._stats['requests'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(batch))
+            self._stats['total_wait'] += sum(waits)
+            self._stats['max_wait'] = max(self._stats['max_wait'], max(waits))
+
+        try:
+            results = self.handler([payload for payload, _, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"{self.name} batch returned {len(results)} results for {len(batch)} requests")
+        except Exception as e:
+            logger.error(f"{self.name} batch of {len(batch)} failed: {str(e)}")
+            with self._lock:
+                self._stats['failed_batches'] += 1
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            requests, batches = self._stats['requests'], self._stats['batches']
+            return {
+                'requests': requests,
+                'batches': batches,
+                'failed_batches': self._stats['failed_batches'],
+                'mean_batch_size': round(requests / batches, 2) if batches else None,
+                'max_batch_size': self._stats['max_batch_size'],
+                'mean_added_wait_ms': round(self._stats['total_wait'] / requests * 1000, 2) if requests else None,
+                'max_added_wait_ms': round(self._stats['max_wait'] * 1000, 2),
+            }
+
+
+class LLMService:
+    """Structured completions for query analysis and title translation"""
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        self.model = os.environ.get("LLM_BATCH_MODEL", "gpt-4")
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self.api_key)
+        return self._client
+
+    def complete(self, prompt: str) -> str:
+        """One chat completion; fails fast while the LLM breaker is open"""
+        response = breaker.call(
+            self.client.chat.completions.create,
+            model=self.model,
+            temperature=0,
+            messages=[{"role": "user", "content": prompt}],
+            timeout=task_control.timeout(BATCH_TIMEOUT),
+        )
+        return response.choices[0].message.content or ""
+
+    def analyze_query(self, query: str) -> Dict:
+        """Translate one query and extract variant terms"""
+        return self._check_analysis(_extract(self.complete(ANALYSIS_PROMPT.format(query=query)), '{', '}'))
+
+    def analyze_queries(self, queries: List[str]) -> List:
+        """Analyze a batch of queries with one completion.
+
+        When the batch reply is unusable the queries are analyzed one by one; a
+        query that fails then gets its exception in place of an analysis, so it
+        does not fail the other callers of the batch.
+        """
+        if len(queries) == 1:
+            return [self.analyze_query(queries[0])]
+        prompt = BATCH_ANALYSIS_PROMPT.format(queries=json.dumps(queries, ensure_ascii=False))
+        try:
+            analyses = [self._check_analysis(a) for a in _extract(self.complete(prompt), '[', ']')]
+            if len(analyses) == len(queries):
+                return analyses
+            logger.warning(f"Batched analysis returned {len(analyses)} results for {len(queries)} queries")
+        except (ValueError, json.JSONDecodeError) as e:
+            logger.warning(f"Batched analysis could not be parsed, analyzing queries one by one: {str(e)}")
+        analyses = []
+        for query in queries:
+            try:
+                analyses.append(self.analyze_query(query))
+            except Exception as e:
+                logger.warning(f"Analysis of query {query!r} failed: {str(e)}")
+                analyses.append(e)
+        return analyses
+
+    def translate_titles(self, titles: List[str]) -> List[str]:
+        """Translate a batch of product titles to English with one completion.
+
+        A reply without exactly one translation per title is retried once as two
+        halves; titles of a half that still fails come back as empty strings
+        rather than failing the rest of the batch. That bounds a batch to three
+        completions.
+        """
+        translations = self._translate_once(titles)
+        if translations is not None:
+            return translations
+        if len(titles) == 1:
+            return [""]
+        middle = len(titles) // 2
+        translations = []
+        for chunk in (titles[:middle], titles[middle:]):
+            try:
+                translations += self._translate_once(chunk) or [""] * len(chunk)
+            except Exception as e:
+                # Includes an open breaker: the other half may already be translated
+                logger.warning(f"Translation of {len(chunk)} titles failed: {str(e)}")
+                translations += [""] * len(chunk)
+        return translations
+
+    def _translate_once(self, titles: List[str]) -> Optional[List[str]]:
+        """One completion; None if the reply does not hold one translation per title"""
+        prompt = BATCH_TITLE_PROMPT.format(titles=json.dumps(titles, ensure_ascii=False))
+        try:
+            translations = [str(t) for t in _extract(self.complete(prompt), '[', ']')]
+            if len(translations) == len(titles):
+                return translations
+            logger.warning(f"Batched translation returned {len(translations)} results for {len(titles)} titles")
+        except (ValueError, json.JSONDecodeError) as e:
+            logger.warning(f"Batched translation could not be parsed: {str(e)}")
+        return None
+
+    @staticmethod
+    def _check_analysis(analysis) -> Dict:
+        if not isinstance(analysis, dict) or not analysis.get("keyword"):
+            raise ValueError(f"Query analysis returned no keyword: {analysis}")
+        analysis.setdefault("variant_terms", [])
+        return analysis
+
+
+BATCHING_ENABLED = os.environ.get("LLM_BATCHING", "true").lower() == "true"
+BATCH_TIMEOUT = float(os.environ.get("LLM_BATCH_TIMEOUT", "120"))
+
+
+def _is_upstream_failure(error: BaseException) -> bool:
+    """Only 5xx, 429 and timeouts count against the breaker; a 4xx (bad request, context length,
+    authentication) is caused by the request itself, as for tmapi"""
+    import openai
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code in (408, 429)
+    return isinstance(error, (openai.APIConnectionError, TimeoutError, ConnectionError))
+
+
+# Shared by every completion made through the batcher; completions can take tens of seconds
+breaker = circuit_breaker.get("llm", excluded=(task_control.TaskAborted,), is_failure=_is_upstream_failure,
+                              slow_call_seconds=60)
+
+service = LLMService()
+query_batcher = MicroBatcher(
+    'query_analysis', service.analyze_queries,
+    max_wait=float(os.environ.get("LLM_BATCH_WAIT_MS", "20")) / 1000,
+    max_batch=int(os.environ.get("LLM_BATCH_MAX_QUERIES", "16")),
+)
+title_batcher = MicroBatcher(
+    'title_translation', service.translate_titles,
+    max_wait=float(os.environ.get("LLM_BATCH_WAIT_MS", "20")) / 1000,
+    max_batch=int(os.environ.get("LLM_BATCH_MAX_TITLES", "50")),
+)
+
+
+def _wait(future: Future):
+    """Wait for a batched result within the current task's remaining budget"""
+    try:
+        return future.result(timeout=task_control.timeout(BATCH_TIMEOUT))
+    except FutureTimeout:
+        task_control.check()
+        raise
+
+
+def analyze_query(query: str) -> Dict:
+    """Translate a buyer query, batched with concurrent callers when enabled"""
+    task_control.check()
+    if not BATCHING_ENABLED:
+        return service.analyze_query(query)
+    return _wait(query_batcher.submit(query))
+
+
+def translate_titles(titles: List[str]) -> List[str]:
+    """Translate titles to English, batched with concurrent callers when enabled"""
+    if not titles:
+        return []
+    task_control.check()
+    if not BATCHING_ENABLED:
+        return service.translate_titles(titles)
+    futures = [title_batcher.submit(title) for title in titles]
+    return [_wait(future) for future in futures]
+
+
+def stats() -> Dict:
+    return {
+        'enabled': BATCHING_ENABLED,
+        'query_analysis': query_batcher.stats(),
+        'title_translation': title_batcher.stats(),
+    }
@@ -0,0 +1,289 @@
+import atexit
+import copy
+import gzip
+import json
+import logging
+import os
+import queue
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict
+
+import task_control
+
+LOG_LEVEL = logging.getLevelName(os.environ.get("LOG_LEVEL", "INFO").upper())
+TASK_LOG_LEVEL = logging.getLevelName(os.environ.get("TASK_LOG_LEVEL", "INFO").upper())
+
+# Records are handed to a background writer; LOG_ASYNC=false writes synchronously
+LOG_ASYNC = os.environ.get("LOG_ASYNC", "true").lower() == "true"
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+# Per-task log store: one gzip-compressed JSON lines file per task, capped in uncompressed bytes
+TASK_LOG_DIR = os.environ.get("TASK_LOG_DIR", os.path.join("logs", "tasks"))
+TASK_LOG_MAX_BYTES = int(os.environ.get("TASK_LOG_MAX_BYTES", str(1024 * 1024)))
+TASK_LOG_MAX_MESSAGE = int(os.environ.get("TASK_LOG_MAX_MESSAGE", "4000"))
+
+# Fields passed through `extra` that are kept in the task log
+EXTRA_FIELDS = ('event', 'tool', 'tool_input', 'tool_output')
+
+_TASK_ID = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+class TaskContextFilter(logging.Filter):
+    """Tag records with the id of the task running in the emitting thread.
+
+    Records outside a task below untagged_level are dropped here, before they
+    reach the queue, since only the task log store would accept them.
+    """
+
+    def __init__(self, untagged_level: int = logging.NOTSET):
+        super().__init__()
+        self.untagged_level = untagged_level
+
+    def filter(self, record):
+        if getattr(record, 'task_id', None) is None:
+            context = task_control.current()
+            record.task_id = context.task_id if context else None
+        return record.task_id is not None or record.levelno >= self.untagged_level
+
+
+class AsyncQueueHandler(QueueHandler):
+    """Queue handler that leaves handler formatting and I/O to the listener thread.
+
+    The standard QueueHandler runs the full formatter in the calling thread; here
+    the caller only renders the message and traceback into a copy of the record,
+    so args the caller keeps mutating cannot change what is written later.
+    Records are dropped, and counted, when the queue is full rather than
+    blocking the caller.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TaskLogStore(logging.Handler):
+    """Write records tagged with a task id to logs/tasks/<task_id>.jsonl.gz.
+
+    Each task log is capped at max_bytes of uncompressed JSON; later records are
+    counted but not stored. Files stay open while the task runs; reading a task's
+    log flushes its file first, so running tasks can be read too.
+    """
+
+    def __init__(self, directory: str = TASK_LOG_DIR, max_bytes: int = TASK_LOG_MAX_BYTES,
+                 max_open: int = 64, level=logging.NOTSET):
+        super().__init__(level)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_open = max_open
+        self._files: "OrderedDict[str, gzip.GzipFile]" = OrderedDict()
+        self._sizes: "OrderedDict[str, Dict]" = OrderedDict()
+        self._stats = {'records': 0, 'bytes': 0, 'truncated_records': 0}
+
+    def path(self, task_id: str) -> str:
+        if not _TASK_ID.match(task_id or ''):
+            raise ValueError(f"Invalid task id: {task_id}")
+        return os.path.join(self.directory, f"{task_id}.jsonl.gz")
+
+    def emit(self, record):
+        task_id = getattr(record, 'task_id', None)
+        if not task_id:
+            return
+        try:
+            if getattr(record, 'close_task', False):
+                self.close_task(task_id)
+                return
+
+            size = self._size(task_id)
+            if size['truncated']:
+                size['dropped'] += 1
+                self._stats['truncated_records'] += 1
+                return
+
+            data = (json.dumps(self.to_entry(record), ensure_ascii=False, default=str) + '\n').encode('utf-8')
+            if size['bytes'] + len(data) > self.max_bytes:
+                size['truncated'] = True
+                size['dropped'] += 1
+                self._stats['truncated_records'] += 1
+                data = (json.dumps({
+                    'timestamp': datetime.utcnow().isoformat(),
+                    'level': 'WARNING',
+                    'logger': __name__,
+                    'message': f"Task log reached {self.max_bytes} bytes; later records are not stored",
+                    'event': 'truncated',
+                }) + '\n').encode('utf-8')
+
+            self._file(task_id).write(data)
+            size['bytes'] += len(data)
+            self._stats['records'] += 1
+            self._stats['bytes'] += len(data)
+        except Exception:
+            self.handleError(record)
+
+    @staticmethod
+    def to_entry(record) -> Dict:
+        message = record.getMessage()
+        if len(message) > TASK_LOG_MAX_MESSAGE:
+            message = message[:TASK_LOG_MAX_MESSAGE] + f"... [{len(message) - TASK_LOG_MAX_MESSAGE} more chars]"
+        entry = {
+            'timestamp': datetime.utcfromtimestamp(record.created).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': message,
+        }
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value if isinstance(value, str) else str(value)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        elif record.exc_info:
+            entry['exception'] = logging.Formatter().formatException(record.exc_info)
+        return entry
+
+    def _size(self, task_id: str) -> Dict:
+        size = self._sizes.get(task_id)
+        if size is None:
+            size = self._sizes[task_id] = {'bytes': 0, 'truncated': False, 'dropped': 0}
+            while len(self._sizes) > 1000:
+                self._sizes.popitem(last=False)
+        return size
+
+    def _file(self, task_id: str):
+        f = self._files.get(task_id)
+        if f is None:
+            os.makedirs(self.directory, exist_ok=True)
+            # Appending after a close starts a new gzip member; readers see one stream
+            f = self._files[task_id] = gzip.open(self.path(task_id), 'ab')
+            while len(self._files) > self.max_open:
+                self._files.popitem(last=False)[1].close()
+        self._files.move_to_end(task_id)
+        return f
+
+    def close_task(self, task_id: str):
+        f = self._files.pop(task_id, None)
+        if f is not None:
+            f.close()
+
+    def close(self):
+        self.acquire()
+        try:
+            while self._files:
+                self._files.popitem()[1].close()
+        finally:
+            self.release()
+        super().close()
+
+    def read(self, task_id: str, offset: int = 0, limit: int = 100, min_level: int = logging.NOTSET) -> Dict:
+        """Return one page of a task's log entries and the total number of matching entries"""
+        path = self.path(task_id)
+        self.acquire()
+        try:
+            if task_id in self._files:
+                self._files[task_id].flush()
+        finally:
+            self.release()
+
+        entries, total = [], 0
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                try:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if logging.getLevelName(entry.get('level', 'NOTSET')) < min_level:
+                            continue
+                        if offset <= total < offset + limit:
+                            entries.append(entry)
+                        total += 1
+                except (EOFError, OSError):
+                    # The task is still writing; entries up to the last flush are complete
+                    pass
+        return {'entries': entries, 'total': total}
+
+    def stats(self) -> Dict:
+        return {**self._stats, 'open_files': len(self._files)}
+
+
+task_log_store = TaskLogStore()
+_state = {'handler': None, 'listener': None}
+_lock = threading.Lock()
+
+
+def setup_logging():
+    """Route all logging through a queue to a background writer thread.
+
+    The writer prints to stderr at LOG_LEVEL and stores records emitted while a
+    task runs in the per-task log store at TASK_LOG_LEVEL. Calling it more than
+    once is safe.
+    """
+    with _lock:
+        if _state['handler'] is not None:
+            return
+
+        stream = logging.StreamHandler()
+        stream.setLevel(LOG_LEVEL)
+        stream.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        stream.addFilter(lambda record: not getattr(record, 'close_task', False))
+        task_log_store.setLevel(TASK_LOG_LEVEL)
+
+        if LOG_ASYNC:
+            handler = AsyncQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+            listener = QueueListener(handler.queue, stream, task_log_store, respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)
+            _state['listener'] = listener
+            handlers = [handler]
+        else:
+            handler = stream
+            handlers = [stream, task_log_store]
+
+        handlers[0].addFilter(TaskContextFilter(LOG_LEVEL))
+        for h in handlers[1:]:
+            h.addFilter(TaskContextFilter())
+        root = logging.getLogger()
+        root.handlers[:] = handlers
+        root.setLevel(min(LOG_LEVEL, TASK_LOG_LEVEL))
+        _state['handler'] = handler
+
+
+def close_task_log(task_id: str):
+    """Close a task's log file once every record logged before this call is written"""
+    record = logging.makeLogRecord({'name': __name__, 'levelno': logging.CRITICAL, 'levelname': 'CRITICAL',
+                                    'msg': 'task log closed', 'task_id': task_id, 'close_task': True})
+    handler = _state['handler']
+    if isinstance(handler, AsyncQueueHandler):
+        handler.enqueue(record)
+    else:
+        task_log_store.handle(record)
+
+
+def stats() -> Dict:
+    handler = _state['handler']
+    return {
+        'async': isinstance(handler, AsyncQueueHandler),
+        'queued': handler.queue.qsize() if isinstance(handler, AsyncQueueHandler) else 0,
+        'dropped': getattr(handler, 'dropped', 0),
+        'task_logs': task_log_store.stats(),
+    }
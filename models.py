@@ -1,19 +1,23 @@
 from database import db
 from datetime import datetime
+import zlib
 
 class Task(db.Model):
     """Task model for storing task information"""
     id = db.Column(db.String(36), primary_key=True)  # UUID string
     user_id = db.Column(db.String(36), nullable=False)  # Added user_id field
     description = db.Column(db.Text, nullable=False)
-    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, completed, failed
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, completed, failed, cancelled
     result = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     completed_at = db.Column(db.DateTime)
     task_metadata = db.Column(db.JSON)  # Renamed from metadata to task_metadata
     webhook_url = db.Column(db.String(500))  # New field for webhook URL
     webhook_retries = db.Column(db.Integer, default=0)  # Track number of webhook retry attempts
     last_webhook_attempt = db.Column(db.DateTime)  # Track last webhook attempt time
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Bumped on every update, used as ETag
+    archived_at = db.Column(db.DateTime)  # Set when the result was moved to task_archive
+    archive = db.relationship('TaskArchive', uselist=False, lazy='select')
 
     def __init__(self, id, description, user_id, webhook_url=None):
         self.id = id
@@ -27,15 +31,16 @@ class Task(db.Model):
         self.webhook_url = webhook_url
         self.webhook_retries = 0
         self.last_webhook_attempt = None
+        self.version = 1
 
     def to_dict(self):
         """Convert task to dictionary representation"""
-        return {
+        task = {
             'id': self.id,
             'user_id': self.user_id,
             'description': self.description,
             'status': self.status,
-            'result': self.result,
+            'result': self.result if self.archived_at is None else self.archived_result(),
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'completed_at': self.completed_at.isoformat() if self.completed_at else None,
             'metadata': self.task_metadata,  # Keep the API response consistent
@@ -43,8 +48,19 @@ class Task(db.Model):
             'webhook_status': {
                 'retries': self.webhook_retries,
                 'last_attempt': self.last_webhook_attempt.isoformat() if self.last_webhook_attempt else None
-            }
+            },
+            'version': self.version
         }
+        metadata = self.task_metadata or {}
+        if metadata.get('refresh_of'):
+            # A refresh reports what changed since the task it refreshed; null until it completes
+            task['refresh_of'] = metadata['refresh_of']
+            task['changes'] = (metadata.get('pipeline') or {}).get('changes')
+        return task
+
+    def archived_result(self):
+        """Decompressed result of an archived task"""
+        return decompress_result(self.archive.result) if self.archive else None
 
     def update_status(self, status, result=None):
         """Update task status and result"""
@@ -55,4 +71,50 @@ class Task(db.Model):
             self.completed_at = datetime.utcnow()
 
     def __repr__(self):
-        return f'<Task {self.id}: {self.status}>'
\ No newline at end of file
+        return f'<Task {self.id}: {self.status}>'
+
+
+class TaskArchive(db.Model):
+    """Compressed results of old tasks, kept out of the live task table"""
+    __tablename__ = 'task_archive'
+    task_id = db.Column(db.String(36), db.ForeignKey('task.id', ondelete='CASCADE'), primary_key=True)
+    result = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed UTF-8 result
+    original_size = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class TaskProfile(db.Model):
+    """Sampling profile captured for a task submitted with profiling enabled"""
+    __tablename__ = 'task_profile'
+    task_id = db.Column(db.String(36), db.ForeignKey('task.id', ondelete='CASCADE'), primary_key=True)
+    profile = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed JSON, see task_profiler
+    samples = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class TitleTranslation(db.Model):
+    """English translation of a 1688 item title, shared by every task that returns the item"""
+    __tablename__ = 'title_translation'
+    item_id = db.Column(db.String(32), primary_key=True)
+    title_hash = db.Column(db.String(32), primary_key=True)  # md5 of the Chinese title; a changed title is translated again
+    english_title = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class JobRun(db.Model):
+    """Daily run of a scheduled job, claimed by one worker across all instances"""
+    __tablename__ = 'job_run'
+    name = db.Column(db.String(50), primary_key=True)
+    run_on = db.Column(db.Date)  # UTC day of the last claimed run
+    owner = db.Column(db.String(100))  # host:pid of the worker that claimed it
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    report = db.Column(db.JSON)
+
+
+def compress_result(result: str) -> bytes:
+    return zlib.compress(result.encode('utf-8'), 9)
+
+
+def decompress_result(blob: bytes) -> str:
+    return zlib.decompress(blob).decode('utf-8')
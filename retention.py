@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import delete, insert, select, update
+
+import job_lease
+import log_pipeline
+from cache_warmer import in_window, parse_hours
+from database import db
+from models import Task, TaskArchive, TaskProfile, compress_result
+from task_cache import task_response_cache
+from tasks import TERMINAL_STATUSES
+from tools import tmapi
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = 'retention'
+
+# Report of the most recent run in this process; /api/metrics serves the one stored in job_run
+last_report: Optional[Dict] = None
+
+
+def strip_webhook_payload(metadata: Optional[Dict]):
+    """Drop the stored copy of the last webhook payload; returns (metadata, stripped)"""
+    delivery = (metadata or {}).get('webhook_delivery')
+    if not isinstance(delivery, dict) or 'last_payload' not in delivery:
+        return metadata, False
+    delivery = {key: value for key, value in delivery.items() if key != 'last_payload'}
+    return {**metadata, 'webhook_delivery': delivery}, True
+
+
+class RetentionJob:
+    """Apply the retention policies to tasks, api_cache and per-task logs.
+
+    - Finished tasks older than archive_days have their result moved to
+      task_archive, zlib-compressed, and their stored webhook payload removed.
+      Task.to_dict() decompresses archived results, so the API is unchanged.
+    - Tasks older than delete_days are deleted (0 keeps them forever).
+    - Live tmapi responses (api_cache/live) older than cache_days are removed,
+      then the oldest files until the directory is under cache_max_bytes (0
+      means no size cap). The recorded responses used by mock mode and the
+      benchmarks are never touched.
+    - Per-task log files older than log_days are removed.
+    """
+
+    def __init__(self, archive_days: Optional[int] = None, delete_days: Optional[int] = None,
+                 cache_days: Optional[int] = None, cache_max_bytes: Optional[int] = None,
+                 log_days: Optional[int] = None, batch_size: Optional[int] = None):
+        self.archive_days = archive_days if archive_days is not None else int(
+            os.environ.get("RETENTION_ARCHIVE_DAYS", "30"))
+        self.delete_days = delete_days if delete_days is not None else int(
+            os.environ.get("RETENTION_DELETE_DAYS", "0"))
+        self.cache_days = cache_days if cache_days is not None else int(
+            os.environ.get("CACHE_RETENTION_DAYS", "30"))
+        self.cache_max_bytes = cache_max_bytes if cache_max_bytes is not None else int(
+            os.environ.get("CACHE_MAX_BYTES", "0"))
+        self.log_days = log_days if log_days is not None else int(
+            os.environ.get("TASK_LOG_RETENTION_DAYS", "30"))
+        self.batch_size = batch_size if batch_size is not None else int(
+            os.environ.get("RETENTION_BATCH_SIZE", "500"))
+
+    def archive_tasks(self) -> Dict:
+        """Move results of old finished tasks to task_archive, one batch per transaction"""
+        report = {'tasks': 0, 'results_archived': 0, 'webhook_payloads_stripped': 0,
+                  'result_bytes': 0, 'archived_bytes': 0, 'metadata_bytes_reclaimed': 0}
+        if self.archive_days <= 0:
+            return {**report, 'skipped': 'disabled'}
+
+        cutoff = datetime.utcnow() - timedelta(days=self.archive_days)
+        stmt = (select(Task.id, Task.result, Task.task_metadata, Task.version)
+                .where(Task.created_at < cutoff,
+                       Task.archived_at.is_(None),
+                       Task.status.in_(TERMINAL_STATUSES))
+                .order_by(Task.created_at)
+                .limit(self.batch_size))
+
+        while True:
+            rows = db.session.execute(stmt).all()
+            if not rows:
+                break
+
+            now = datetime.utcnow()
+            archived = []
+            for task_id, result, metadata, version in rows:
+                stripped_metadata, stripped = strip_webhook_payload(metadata)
+                # Compare-and-set on the version read above: a task updated since then
+                # (a webhook attempt, a metadata merge) is left for the next pass
+                matched = db.session.execute(
+                    update(Task)
+                    .where(Task.id == task_id, Task.version == version, Task.archived_at.is_(None))
+                    .values(result=None, task_metadata=stripped_metadata, archived_at=now,
+                            version=Task.version + 1)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                if not matched:
+                    continue
+                archived.append(task_id)
+
+                if result:
+                    blob = compress_result(result)
+                    db.session.execute(insert(TaskArchive).values(
+                        task_id=task_id, result=blob, original_size=len(result.encode('utf-8')), archived_at=now))
+                    report['result_bytes'] += len(result.encode('utf-8'))
+                    report['archived_bytes'] += len(blob)
+                    report['results_archived'] += 1
+                if stripped:
+                    report['webhook_payloads_stripped'] += 1
+                    report['metadata_bytes_reclaimed'] += (len(json.dumps(metadata, ensure_ascii=False))
+                                                           - len(json.dumps(stripped_metadata, ensure_ascii=False)))
+            db.session.commit()
+            for task_id in archived:
+                task_response_cache.invalidate(task_id)
+            report['tasks'] += len(archived)
+
+        report['bytes_reclaimed'] = (report['result_bytes'] - report['archived_bytes']
+                                     + report['metadata_bytes_reclaimed'])
+        return report
+
+    def delete_tasks(self) -> Dict:
+        """Delete tasks, and their archived results and profiles, older than delete_days"""
+        if self.delete_days <= 0:
+            return {'tasks': 0, 'skipped': 'disabled'}
+
+        cutoff = datetime.utcnow() - timedelta(days=self.delete_days)
+        deleted = 0
+        while True:
+            ids = db.session.execute(
+                select(Task.id).where(Task.created_at < cutoff).limit(self.batch_size)).scalars().all()
+            if not ids:
+                break
+            db.session.execute(delete(TaskArchive).where(TaskArchive.task_id.in_(ids)))
+            db.session.execute(delete(TaskProfile).where(TaskProfile.task_id.in_(ids)))
+            db.session.execute(delete(Task).where(Task.id.in_(ids)))
+            db.session.commit()
+            for task_id in ids:
+                task_response_cache.invalidate(task_id)
+            deleted += len(ids)
+        return {'tasks': deleted}
+
+    @staticmethod
+    def prune_directory(directory: str, suffix: str, max_age_days: int, max_bytes: int = 0) -> Dict:
+        """Remove files older than max_age_days, then the oldest files until under max_bytes"""
+        report = {'files_scanned': 0, 'files_removed': 0, 'bytes_before': 0, 'bytes_reclaimed': 0}
+        if not os.path.isdir(directory):
+            return report
+
+        files = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(suffix):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        report['files_scanned'] = len(files)
+        report['bytes_before'] = total = sum(size for _, size, _ in files)
+
+        files.sort()
+        cutoff = time.time() - max_age_days * 86400 if max_age_days > 0 else None
+        for mtime, size, path in files:
+            expired = cutoff is not None and mtime < cutoff
+            if not expired and not (max_bytes > 0 and total > max_bytes):
+                # Oldest first: every later file is newer and the size budget is met
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Failed to remove {path}: {str(e)}")
+                continue
+            total -= size
+            report['files_removed'] += 1
+            report['bytes_reclaimed'] += size
+        return report
+
+    def prune_cache(self) -> Dict:
+        return self.prune_directory(tmapi.LIVE_CACHE_DIR, '.json', self.cache_days, self.cache_max_bytes)
+
+    def prune_task_logs(self) -> Dict:
+        return self.prune_directory(log_pipeline.TASK_LOG_DIR, '.jsonl.gz', self.log_days)
+
+    def run(self) -> Dict:
+        """Run every policy and return a report of the space reclaimed"""
+        global last_report
+        started = time.perf_counter()
+        report = {
+            'started_at': datetime.utcnow().isoformat(),
+            'policies': {
+                'archive_days': self.archive_days,
+                'delete_days': self.delete_days,
+                'cache_days': self.cache_days,
+                'cache_max_bytes': self.cache_max_bytes,
+                'log_days': self.log_days,
+            },
+            'archive': self.archive_tasks(),
+            'delete': self.delete_tasks(),
+            'api_cache': self.prune_cache(),
+            'task_logs': self.prune_task_logs(),
+        }
+        report['bytes_reclaimed'] = sum(report[section].get('bytes_reclaimed', 0)
+                                        for section in ('archive', 'api_cache', 'task_logs'))
+        report['duration_s'] = round(time.perf_counter() - started, 3)
+        logger.info(f"Retention run reclaimed {report['bytes_reclaimed']} bytes: "
+                    f"{report['archive']['tasks']} tasks archived, {report['delete']['tasks']} deleted, "
+                    f"{report['api_cache'].get('files_removed', 0)} cache files and "
+                    f"{report['task_logs']['files_removed']} task logs removed")
+        last_report = report
+        try:
+            job_lease.save_report(JOB_NAME, report)
+        except Exception as e:
+            logger.warning(f"Failed to store retention report: {str(e)}")
+            db.session.rollback()
+        return report
+
+
+def start_scheduler(app, interval: float = 300):
+    """Run the retention job once a day inside the RETENTION_HOURS UTC window.
+
+    Like the cache warmer, every worker runs this loop and only the one that
+    claims the day's job_run row runs the job, so two workers never archive
+    the same tasks. api_cache and task logs are pruned on that worker's
+    instance; alternatively leave RETENTION_ENABLED unset and run
+    `flask retention` from cron on each host.
+    """
+    window = parse_hours(os.environ.get("RETENTION_HOURS", "3-5"))
+    state = {'last_run': None}
+
+    def loop():
+        while True:
+            now = datetime.utcnow()
+            if in_window(now.hour, window) and state['last_run'] != now.date():
+                state['last_run'] = now.date()
+                with app.app_context():
+                    try:
+                        if job_lease.claim_daily(JOB_NAME, now.date()):
+                            RetentionJob().run()
+                        else:
+                            logger.info("Retention job already ran on another worker today")
+                    except Exception as e:
+                        logger.error(f"Retention run failed: {str(e)}")
+                        db.session.rollback()
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="retention")
+    thread.daemon = True
+    thread.start()
+    logger.info(f"Retention job scheduled for {window[0]:02d}:00-{window[1]:02d}:00 UTC")
+    return thread
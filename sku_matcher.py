@@ -0,0 +1,318 @@
+import logging
+import math
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# The item_detail tool returns the full SKU list when disabled
+ENABLED = os.environ.get("SKU_MATCHER_ENABLED", "true").lower() == "true"
+
+# Number of variants handed to the detail agent when none is picked outright
+TOP_N = int(os.environ.get("SKU_MATCHER_TOP_N", "5"))
+
+# Highest score a term can get without appearing verbatim in a value name
+PARTIAL_MATCH = 0.9
+
+# Fields of the item detail payload that the detail agent still receives
+DETAIL_FIELDS = ('item_id', 'title', 'product_url', 'price_info', 'tiered_price_info',
+                 'sale_info', 'product_props', 'is_sold_out')
+
+# Units by dimension, with the factor to the dimension's base unit
+UNITS = {
+    'weight': {'g': 1, '克': 1, 'kg': 1000, '公斤': 1000, '千克': 1000, '斤': 500, '两': 50,
+               'mg': 0.001, '毫克': 0.001},
+    'volume': {'ml': 1, '毫升': 1, 'l': 1000, '升': 1000},
+    'length': {'mm': 0.1, '毫米': 0.1, 'cm': 1, '厘米': 1, '米': 100},
+    'size': {'码': 1, 'eu': 1},
+    'age': {'岁': 1},
+    'count': {'pcs': 1, '个': 1, '只': 1, '片': 1, '支': 1, '粒': 1, '条': 1, '枚': 1},
+}
+_UNIT_DIMENSION = {unit: (dimension, factor) for dimension, units in UNITS.items()
+                   for unit, factor in units.items()}
+_UNIT_PATTERN = '|'.join(sorted(map(re.escape, _UNIT_DIMENSION), key=len, reverse=True))
+_QUANTITY = re.compile(
+    r'(\d+(?:\.\d+)?)(?:\s*[-~～到]\s*(\d+(?:\.\d+)?))?\s*(' + _UNIT_PATTERN + r')(?![a-z])', re.IGNORECASE)
+_SIZE_NUMBER = re.compile(r'\bsize\s*(\d+(?:\.\d+)?)\b', re.IGNORECASE)
+_LETTER_SIZE = re.compile(r'(?<![a-z0-9])(x{0,3}s|m|x{0,4}l|[2-6]xl)(?![a-z0-9])', re.IGNORECASE)
+_MODEL = re.compile(r'\b(?=[a-z0-9+]*\d)(?=[a-z0-9+]*[a-z])[a-z0-9+]{2,}\b', re.IGNORECASE)
+
+# English attribute words mapped to the Chinese fragments used in 1688 SKU names
+COLORS = {
+    'black': '黑', 'white': '白', 'red': '红', 'blue': '蓝', 'green': '绿', 'grey': '灰', 'gray': '灰',
+    'pink': '粉', 'yellow': '黄', 'purple': '紫', 'orange': '橙', 'brown': '棕', 'gold': '金',
+    'golden': '金', 'silver': '银', 'beige': '米', 'khaki': '卡其', 'navy': '藏青', 'coffee': '咖',
+    'transparent': '透明', 'clear': '透明',
+}
+MATERIALS = {
+    'cotton': '棉', 'leather': '皮', 'silicone': '硅胶', 'plastic': '塑料', 'stainless': '不锈钢',
+    'steel': '钢', 'wood': '木', 'wooden': '木', 'glass': '玻璃', 'ceramic': '陶瓷', 'silk': '丝',
+    'wool': '羊毛', 'linen': '麻', 'bamboo': '竹', 'metal': '金属', 'aluminum': '铝', 'polyester': '涤纶',
+}
+
+# Units that also appear in ordinary words ("size m", "1 l"), skipped when they stand alone
+_AMBIGUOUS_LETTER_SIZES = {'m', 'l', 's'}
+
+
+class Constraint(NamedTuple):
+    """One attribute the buyer asked for: a text fragment or a quantity range"""
+    kind: str  # 'term', 'token' or a quantity dimension such as 'weight'
+    text: str = ''
+    low: float = 0.0
+    high: float = 0.0
+
+    def describe(self) -> str:
+        if self.kind in ('term', 'token'):
+            return self.text
+        span = f"{self.low:g}" if self.low == self.high else f"{self.low:g}-{self.high:g}"
+        return f"{self.kind}={span}"
+
+
+def normalize(text: str) -> str:
+    """Lowercase and drop whitespace, brackets and punctuation: 灰色（男款） -> 灰色男款"""
+    return re.sub(r'[\W_]+', '', text or '').lower()
+
+
+def _letter_size(text: str) -> str:
+    text = text.lower()
+    match = re.match(r'([2-6])xl$', text)
+    return 'x' * (int(match.group(1)) - 1) + 'xl' if match else text
+
+
+def parse_quantities(text: str) -> List[Constraint]:
+    """Quantities such as 500克, 1.5kg, 39-42码 or 2-4岁, in base units"""
+    quantities = []
+    for match in _QUANTITY.finditer(text or ''):
+        dimension, factor = _UNIT_DIMENSION[match.group(3).lower()]
+        low = float(match.group(1)) * factor
+        high = float(match.group(2)) * factor if match.group(2) else low
+        quantities.append(Constraint(dimension, low=min(low, high), high=max(low, high)))
+    for match in _SIZE_NUMBER.finditer(text or ''):
+        quantities.append(Constraint('size', low=float(match.group(1)), high=float(match.group(1))))
+    return quantities
+
+
+def _in_product_name(fragment: str, keyword: str) -> bool:
+    """Whether the keyword uses the fragment as part of the noun, as in 黑茶, rather than as 黑色"""
+    return any(not keyword.startswith('色', match.end())
+               for match in re.finditer(re.escape(fragment), keyword))
+
+
+def parse_constraints(query: str, keyword: str = '', variant_terms: Iterable[str] = ()) -> List[Constraint]:
+    """Attribute constraints from the buyer query, its Chinese keyword and the extracted variant terms.
+
+    The keyword names the product rather than the variant, so only its
+    quantities are used; colors and materials come from the English query and
+    the variant terms. A color the keyword uses as part of the product name
+    ("black tea" -> 黑茶) is not a constraint.
+    """
+    constraints = parse_quantities(query) + parse_quantities(keyword)
+
+    words = re.findall(r'[a-z]+', (query or '').lower())
+    product = normalize(keyword)
+    constraints += [Constraint('term', COLORS[w]) for w in words
+                    if w in COLORS and not _in_product_name(COLORS[w], product)]
+    constraints += [Constraint('term', MATERIALS[w]) for w in words if w in MATERIALS]
+
+    stripped_query = _QUANTITY.sub(' ', query or '')
+    for match in _LETTER_SIZE.finditer(stripped_query):
+        size = match.group(1)
+        # A bare S/M/L only counts when the query talks about size
+        if size.lower() in _AMBIGUOUS_LETTER_SIZES and 'size' not in words:
+            continue
+        constraints.append(Constraint('token', _letter_size(size)))
+    for match in _MODEL.finditer(stripped_query):
+        if not _LETTER_SIZE.fullmatch(match.group()):
+            constraints.append(Constraint('term', normalize(match.group())))
+
+    for term in variant_terms or ():
+        term = (term or '').strip()
+        quantities = parse_quantities(term)
+        constraints += quantities
+        rest = normalize(_QUANTITY.sub('', term) if quantities else term)
+        if rest.endswith('色') and len(rest) > 1:
+            rest = rest[:-1]
+        if _LETTER_SIZE.fullmatch(rest):
+            constraints.append(Constraint('token', _letter_size(rest)))
+        elif rest:
+            constraints.append(Constraint('term', rest))
+
+    return list(dict.fromkeys(constraints))
+
+
+class _Value(NamedTuple):
+    prop_name: str
+    name: str
+    normalized: str
+    quantities: List[Constraint]
+
+
+class SkuIndex:
+    """Property values of one item, parsed once, and the values each SKU combines.
+
+    Each constraint is scored once per property value; a SKU's score is the
+    mean over constraints of its best-matching value, so ranking hundreds of
+    SKUs costs little more than reading them.
+    """
+
+    def __init__(self, detail: Optional[Dict]):
+        detail = detail or {}
+        self.values: Dict[Tuple[str, str], _Value] = {}
+        for prop in detail.get('sku_props') or []:
+            for value in prop.get('values') or []:
+                self._add((str(prop.get('pid')), str(value.get('vid'))), prop.get('prop_name', ''),
+                          value.get('name', ''))
+
+        self.skus: List[Tuple[Dict, List[Tuple[str, str]]]] = []
+        for sku in detail.get('skus') or []:
+            keys = [tuple(pair.split(':', 1)) for pair in (sku.get('props_ids') or '').split(';') if ':' in pair]
+            if not keys or any(key not in self.values for key in keys):
+                # Fall back to the names when ids are missing or do not resolve
+                keys = []
+                for pair in (sku.get('props_names') or '').split(';'):
+                    prop_name, _, name = pair.rpartition(':')
+                    keys.append(self._add(('name', pair), prop_name, name))
+            self.skus.append((sku, keys))
+
+    def _add(self, key, prop_name: str, name: str):
+        if key not in self.values:
+            self.values[key] = _Value(prop_name, name, normalize(name), parse_quantities(name))
+        return key
+
+    @staticmethod
+    def value_score(value: _Value, constraint: Constraint) -> float:
+        if constraint.kind == 'term':
+            if constraint.text in value.normalized:
+                return 1.0
+            # Partial credit for the share of the term's characters found, never a full match
+            found = sum(1 for char in constraint.text if char in value.normalized)
+            return PARTIAL_MATCH * found / len(constraint.text)
+        if constraint.kind == 'token':
+            tokens = {_letter_size(t) for t in _LETTER_SIZE.findall(value.normalized)}
+            return 1.0 if constraint.text in tokens else 0.0
+        best = 0.0
+        for quantity in value.quantities:
+            if quantity.kind != constraint.kind:
+                continue
+            if quantity.low <= constraint.low and constraint.high <= quantity.high:
+                return 1.0
+            middle = (quantity.low + quantity.high) / 2
+            if middle and abs(middle - (constraint.low + constraint.high) / 2) <= 0.1 * middle:
+                best = 0.5
+        return best
+
+    def rank(self, constraints: List[Constraint]) -> Tuple[List[Tuple[float, Dict]], int]:
+        """Score every SKU; returns (score, sku) best first and the number of applicable constraints.
+
+        Constraints that match no value of this item (a weight asked for on a
+        phone case) are ignored, so they neither lower scores nor block a pick.
+        """
+        value_scores = {key: [self.value_score(value, c) for c in constraints]
+                        for key, value in self.values.items()}
+        applicable = [i for i in range(len(constraints))
+                      if any(scores[i] > 0 for scores in value_scores.values())]
+
+        scored = []
+        for sku, keys in self.skus:
+            if applicable:
+                total = sum(max((value_scores[key][i] for key in keys), default=0.0) for i in applicable)
+                score = total / len(applicable)
+            else:
+                score = 0.0
+            scored.append((score, sku))
+
+        def order(entry):
+            score, sku = entry
+            in_stock = 1 if (sku.get('stock') or 0) > 0 else 0
+            return (score, in_stock, -_price(sku))
+
+        scored.sort(key=order, reverse=True)
+        return scored, len(applicable)
+
+
+def _price(sku: Dict) -> float:
+    match = re.search(r'\d+(?:\.\d+)?', str(sku.get('sale_price') or ''))
+    return float(match.group()) if match else math.inf
+
+
+def match(detail: Optional[Dict], constraints: List[Constraint]) -> Dict:
+    """Rank the variants of an item against the constraints.
+
+    Returns {"variants": [(score, sku), ...], "selected": sku or None,
+    "applicable": n}. A variant is selected outright when it is the only one,
+    or when it alone matches every applicable constraint.
+    """
+    index = SkuIndex(detail)
+    variants, applicable = index.rank(constraints)
+    selected = None
+    if len(variants) == 1:
+        selected = variants[0][1]
+    elif applicable and variants and variants[0][0] == 1.0 and variants[1][0] < 1.0:
+        selected = variants[0][1]
+    return {'variants': variants, 'selected': selected, 'applicable': applicable}
+
+
+def best_variant(detail: Optional[Dict], constraints: List[Constraint]) -> Optional[Dict]:
+    """The selected variant, or the best-ranked one when the match is ambiguous"""
+    result = match(detail, constraints)
+    if result['selected'] is not None:
+        return result['selected']
+    return result['variants'][0][1] if result['variants'] else None
+
+
+def _sku_summary(sku: Dict, score: Optional[float] = None) -> Dict:
+    summary = {key: sku.get(key) for key in ('skuid', 'props_names', 'sale_price', 'stock')}
+    if score is not None:
+        summary['match_score'] = round(score, 2)
+    return summary
+
+
+def trim_detail(detail: Optional[Dict], constraints: List[Constraint], top_n: int = TOP_N) -> Dict:
+    """Reduce an item detail payload to what the detail agent needs to choose a variant.
+
+    Only the top_n ranked variants are kept, or just the selected one when the
+    match is unambiguous; sku_props keeps the names of the values they use.
+    """
+    if not detail:
+        return {}
+    result = match(detail, constraints)
+    trimmed = {key: detail[key] for key in DETAIL_FIELDS if key in detail}
+    trimmed['skus_total'] = len(result['variants'])
+
+    if result['selected'] is not None:
+        kept = [(None, result['selected'])]
+        trimmed['selected_sku'] = _sku_summary(result['selected'])
+    else:
+        kept = result['variants'][:top_n]
+    trimmed['skus'] = [_sku_summary(sku, score) for score, sku in kept]
+
+    used = set()
+    for _, sku in kept:
+        used.update(pair.rpartition(':')[2] for pair in (sku.get('props_names') or '').split(';'))
+    trimmed['sku_props'] = [
+        {'prop_name': prop.get('prop_name'),
+         'values': [v.get('name') for v in prop.get('values') or [] if v.get('name') in used]}
+        for prop in detail.get('sku_props') or []
+    ]
+    return trimmed
+
+
+# Constraints of the crew task running in this thread, read by the item_detail tool
+_local = threading.local()
+
+
+@contextmanager
+def use_constraints(constraints: List[Constraint]):
+    previous = getattr(_local, 'constraints', None)
+    _local.constraints = constraints
+    try:
+        yield
+    finally:
+        _local.constraints = previous
+
+
+def current_constraints() -> List[Constraint]:
+    return getattr(_local, 'constraints', None) or []
@@ -0,0 +1,51 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class TaskResponseCache:
+    """In-process LRU of serialized GET /api/tasks/<task_id> responses.
+
+    Only finished tasks are cached. Entries are keyed by task id and stored with
+    the task version they were rendered from, so a stale entry is never served
+    even when another worker updated the row.
+    """
+
+    def __init__(self, max_entries: int = 2000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'invalidations': 0}
+
+    def get(self, task_id: str, version: int) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is None or entry[0] != version:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(task_id)
+            self._stats['hits'] += 1
+            return entry[1]
+
+    def put(self, task_id: str, version: int, body: bytes):
+        with self._lock:
+            self._entries[task_id] = (version, body)
+            self._entries.move_to_end(task_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, task_id: str):
+        with self._lock:
+            if self._entries.pop(task_id, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def record_not_modified(self):
+        with self._lock:
+            self._stats['not_modified'] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**self._stats, 'entries': len(self._entries)}
+
+
+task_response_cache = TaskResponseCache()
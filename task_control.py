@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Overall time budget for a task and optional per-stage budgets, in seconds.
+# TASK_STAGE_BUDGETS is a JSON object such as {"search_task": 120, "detail": 30}.
+TASK_DEADLINE = float(os.environ.get("TASK_DEADLINE", "600"))
+STAGE_BUDGETS: Dict[str, float] = json.loads(os.environ.get("TASK_STAGE_BUDGETS", "{}"))
+
+# How often the owning thread re-reads the task status to notice cancellations made by other workers
+CANCEL_POLL_INTERVAL = float(os.environ.get("TASK_CANCEL_POLL_INTERVAL", "5"))
+
+
+class TaskAborted(Exception):
+    """Raised inside a running task when it must stop early"""
+
+    def __init__(self, task_id: str, stage: Optional[str], message: str):
+        super().__init__(message)
+        self.task_id = task_id
+        self.stage = stage
+
+
+class TaskCancelled(TaskAborted):
+    pass
+
+
+class DeadlineExceeded(TaskAborted):
+    pass
+
+
+class TaskContext:
+    """Cancellation flag, deadline and stage budgets of one running task"""
+
+    def __init__(self, task_id: str, deadline: Optional[float] = None,
+                 stage_budgets: Optional[Dict[str, float]] = None,
+                 poll: Optional[Callable[[], Optional[str]]] = None):
+        self.task_id = task_id
+        self.started = time.monotonic()
+        self.deadline = self.started + (TASK_DEADLINE if deadline is None else deadline)
+        self.stage_budgets = STAGE_BUDGETS if stage_budgets is None else stage_budgets
+        self.stage: Optional[str] = None
+        self.stage_deadline: Optional[float] = None
+        self.partial_result = None
+        self._cancelled = threading.Event()
+        self._poll = poll
+        self._owner = threading.get_ident()
+        self._last_poll = self.started
+        # Threads currently working for the task: the owner and functions run through bind()
+        self.threads = {self._owner}
+
+    def enter_stage(self, stage: str):
+        self.check()
+        self.stage = stage
+        budget = self.stage_budgets.get(stage)
+        self.stage_deadline = time.monotonic() + budget if budget else None
+        logger.debug(f"Task {self.task_id} entered stage {stage} ({self.remaining():.1f}s left)")
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        deadline = self.deadline if self.stage_deadline is None else min(self.deadline, self.stage_deadline)
+        return deadline - time.monotonic()
+
+    def timeout(self, default: float) -> float:
+        """Clamp a network timeout to the time left, never below one second"""
+        return max(1.0, min(default, self.remaining()))
+
+    def check(self):
+        """Raise TaskCancelled or DeadlineExceeded if the task should stop"""
+        if not self.cancelled and self._poll and threading.get_ident() == self._owner:
+            now = time.monotonic()
+            if now - self._last_poll >= CANCEL_POLL_INTERVAL:
+                self._last_poll = now
+                if self._poll() == 'cancelled':
+                    self.cancel()
+        if self.cancelled:
+            raise TaskCancelled(self.task_id, self.stage, "Task was cancelled")
+        if self.remaining() <= 0:
+            where = f" in stage {self.stage}" if self.stage else ""
+            raise DeadlineExceeded(self.task_id, self.stage, f"Task deadline exceeded{where}")
+
+
+_contexts: Dict[str, TaskContext] = {}
+_contexts_lock = threading.Lock()
+_local = threading.local()
+
+
+def start(task_id: str, **kwargs) -> TaskContext:
+    """Register a context for task_id and make it current in this thread"""
+    context = TaskContext(task_id, **kwargs)
+    with _contexts_lock:
+        _contexts[task_id] = context
+    _local.context = context
+    return context
+
+
+def finish(task_id: str):
+    with _contexts_lock:
+        _contexts.pop(task_id, None)
+    if getattr(_local, 'context', None) and _local.context.task_id == task_id:
+        _local.context = None
+
+
+def cancel(task_id: str) -> bool:
+    """Signal a task running in this process to stop; returns False if it is not running here"""
+    with _contexts_lock:
+        context = _contexts.get(task_id)
+    if context is None:
+        return False
+    context.cancel()
+    return True
+
+
+def current() -> Optional[TaskContext]:
+    return getattr(_local, 'context', None)
+
+
+def bind(fn: Callable) -> Callable:
+    """Wrap fn so that it runs with the caller's task context in a worker thread"""
+    context = current()
+
+    def run(*args, **kwargs):
+        previous = current()
+        _local.context = context
+        ident = threading.get_ident()
+        owned = context is not None and ident not in context.threads
+        if owned:
+            context.threads.add(ident)
+        try:
+            if context:
+                context.check()
+            return fn(*args, **kwargs)
+        finally:
+            if owned:
+                context.threads.discard(ident)
+            _local.context = previous
+
+    return run
+
+
+def check():
+    """Check the current task context, if any"""
+    context = current()
+    if context:
+        context.check()
+
+
+def enter_stage(stage: str):
+    """Start a new stage of the current task, raising if it should stop"""
+    context = current()
+    if context:
+        context.enter_stage(stage)
+
+
+def set_partial(result):
+    """Remember the best result so far, stored if the task is aborted"""
+    context = current()
+    if context:
+        context.partial_result = result
+
+
+def timeout(default: float) -> float:
+    """Network timeout for the current task, clamped to its remaining budget"""
+    context = current()
+    return context.timeout(default) if context else default
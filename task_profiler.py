@@ -0,0 +1,163 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Default sampling rate of profiled tasks, in samples per second per thread
+PROFILE_HZ = float(os.environ.get("TASK_PROFILE_HZ", "100"))
+MAX_PROFILE_HZ = 1000.0
+
+# Deeper stacks are cut at the root side
+MAX_DEPTH = int(os.environ.get("TASK_PROFILE_MAX_DEPTH", "128"))
+
+# Where a sample's time went: the first rule matching a frame, from the root of the stack to the leaf.
+# A tool HTTP call made by an agent is "http" and an agent's LLM call is "llm", whatever crewai frames sit above.
+CATEGORIES = (
+    ('llm', re.compile(r'(^|/)(openai|litellm|anthropic)/|llm_batcher\.py')),
+    ('http', re.compile(r'(^|/)(requests|urllib3|httpx|httpcore)/|tools/prefetch\.py')),
+    ('db', re.compile(r'(^|/)(sqlalchemy|psycopg2|flask_sqlalchemy)/|sqlite3/')),
+    ('json', re.compile(r'(^|/)json/|\b(format_result|_extract_json|_strip_markdown)\b')),
+    ('logging', re.compile(r'(^|/)logging/|log_pipeline\.py')),
+)
+
+_ROOT = os.getcwd() + os.sep
+
+
+def _short_path(path: str) -> str:
+    if path.startswith(_ROOT):
+        return path[len(_ROOT):]
+    marker = path.rfind('site-packages' + os.sep)
+    if marker >= 0:
+        return path[marker + len('site-packages') + 1:]
+    marker = path.rfind(os.sep + 'lib' + os.sep + 'python')
+    if marker >= 0:
+        # Standard library: lib/python3.11/json/decoder.py -> json/decoder.py
+        return path[marker:].split(os.sep, 4)[-1]
+    return os.path.basename(path)
+
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler for the threads of one task.
+
+    A background thread reads sys._current_frames() `hz` times a second and
+    counts the stack of every thread returned by `threads`, so time spent
+    waiting on HTTP, the LLM or the database shows up like CPU time. Stacks are
+    kept as code objects while sampling and only turned into text in
+    profile(), which keeps a sample to a few microseconds per thread.
+    """
+
+    def __init__(self, threads: Callable[[], Iterable[int]], hz: float = PROFILE_HZ):
+        self.threads = threads
+        self.hz = min(max(float(hz), 1.0), MAX_PROFILE_HZ)
+        self._counts: Counter = Counter()
+        self._labels: Dict = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+        self._duration = 0.0
+        self.samples = 0
+        self.overhead = 0.0
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="task-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Dict:
+        """Stop sampling and return the profile"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._duration = time.perf_counter() - self._started
+        return self.profile()
+
+    def _run(self):
+        interval = 1.0 / self.hz
+        next_at = time.perf_counter()
+        names = {}
+        while not self._stop.wait(max(0.0, next_at - time.perf_counter())):
+            started = time.perf_counter()
+            frames = sys._current_frames()
+            for ident in list(self.threads()):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                codes = []
+                while frame is not None and len(codes) < MAX_DEPTH:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                self._counts[(names.get(ident, 'thread'), tuple(codes))] += 1
+                self.samples += 1
+            del frames
+            now = time.perf_counter()
+            self.overhead += now - started
+            next_at = max(next_at + interval, now)
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    @staticmethod
+    def _category(labels) -> str:
+        for label in labels:
+            for name, pattern in CATEGORIES:
+                if pattern.search(label):
+                    return name
+        return 'other'
+
+    def profile(self) -> Dict:
+        """Folded stacks ("thread;outer;...;inner count" per line) with a summary.
+
+        The folded text can be fed to flamegraph.pl or loaded into speedscope.
+        """
+        stacks = Counter()
+        categories = Counter()
+        self_samples = Counter()
+        total_samples = Counter()
+        for (thread_name, codes), count in self._counts.items():
+            labels = [self._label(code) for code in reversed(codes)]
+            # ThreadPoolExecutor-3_0 and ThreadPoolExecutor-7_1 are the same kind of thread
+            root = re.sub(r'[-_]?\d+', '', thread_name) or 'thread'
+            stacks[';'.join([root] + labels)] += count
+            categories[self._category(labels)] += count
+            if labels:
+                self_samples[labels[-1]] += count
+            for label in set(labels):
+                total_samples[label] += count
+
+        interval = 1.0 / self.hz
+        return {
+            'format': 'folded',
+            'hz': self.hz,
+            'samples': self.samples,
+            'duration_s': round(self._duration, 3),
+            'overhead_s': round(self.overhead, 4),
+            'categories': {name: {'samples': count, 'seconds': round(count * interval, 3)}
+                           for name, count in categories.most_common()},
+            'top_self': [{'frame': label, 'samples': count} for label, count in self_samples.most_common(25)],
+            'top_total': [{'frame': label, 'samples': count} for label, count in total_samples.most_common(25)],
+            'folded': '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common()),
+        }
+
+
+def profile_hz(value) -> Optional[float]:
+    """Sampling rate requested through the API: true uses TASK_PROFILE_HZ, a number sets the rate"""
+    if value is None or value is False:
+        return None
+    if value is True:
+        return PROFILE_HZ
+    hz = float(value)
+    if not 1 <= hz <= MAX_PROFILE_HZ:
+        raise ValueError(f"profile must be true or a sampling rate between 1 and {MAX_PROFILE_HZ:g} Hz")
+    return hz
@@ -1,17 +1,67 @@
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Iterable
 import requests
 import logging
 import json
+import threading
+from collections import deque
+from contextlib import contextmanager
+from flask import current_app
 from database import db
-from models import Task
+from models import Task, TaskProfile, compress_result, decompress_result
+from task_cache import task_response_cache
 import uuid
 from datetime import datetime
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from sqlalchemy import update, event, func, cast, bindparam, literal
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.postgresql import JSONB
 import traceback
 
 logger = logging.getLogger(__name__)
 
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+# DB round trip accounting: statements and commits issued by the current thread
+_tracking = threading.local()
+_round_trip_history = deque(maxlen=200)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_tracking, 'task_id', None):
+        _tracking.count += 1
+
+
+@event.listens_for(Engine, 'commit')
+def _count_commit(conn):
+    if getattr(_tracking, 'task_id', None):
+        _tracking.count += 1
+
+
+@contextmanager
+def track_round_trips(task_id: str):
+    """Count DB statements and commits issued by this thread while processing a task"""
+    _tracking.task_id, _tracking.count = task_id, 0
+    try:
+        yield
+    finally:
+        _round_trip_history.append({'task_id': task_id, 'round_trips': _tracking.count})
+        logger.info(f"Task {task_id} used {_tracking.count} DB round trips")
+        _tracking.task_id = None
+
+
+def round_trip_stats() -> Dict:
+    history = list(_round_trip_history)
+    counts = [entry['round_trips'] for entry in history]
+    return {
+        'tasks': len(counts),
+        'mean': round(sum(counts) / len(counts), 2) if counts else None,
+        'max': max(counts) if counts else None,
+        'recent': history[-10:],
+    }
+
 class TaskQueue:
     def __init__(self):
         # Configure requests session with retry mechanism
@@ -24,9 +74,12 @@ class TaskQueue:
         self.session.mount('http://', HTTPAdapter(max_retries=retries))
         self.session.mount('https://', HTTPAdapter(max_retries=retries))
 
-    def add_task(self, description: str, user_id: str, webhook_url: Optional[str] = None) -> str:
+    def add_task(self, description: str, user_id: str, webhook_url: Optional[str] = None,
+                 task_id: Optional[str] = None, metadata: Optional[Dict] = None) -> str:
         """Add a new task to the queue"""
-        task = Task(id=str(uuid.uuid4()), description=description, user_id=user_id, webhook_url=webhook_url)
+        task = Task(id=task_id or str(uuid.uuid4()), description=description, user_id=user_id, webhook_url=webhook_url)
+        if metadata:
+            task.task_metadata = dict(metadata)
         db.session.add(task)
         db.session.commit()
         return task.id
@@ -36,44 +89,140 @@ class TaskQueue:
         task = Task.query.get(task_id)
         return task.to_dict() if task else None
 
-    def get_all_tasks(self) -> List[Dict]:
-        """Get all tasks with their status"""
-        tasks = Task.query.order_by(Task.created_at.desc()).all()
-        return [task.to_dict() for task in tasks]
+    def get_task_version(self, task_id: str) -> Optional[int]:
+        """Get only the version counter of a task, or None if it does not exist"""
+        return db.session.query(Task.version).filter(Task.id == task_id).scalar()
 
-    def update_task(self, task_id: str, status: str, result: Optional[str] = None):
-        """Update task status and result"""
-        task = Task.query.get(task_id)
-        if task:
-            if status == 'completed':
-                task.completed_at = datetime.utcnow()
-            task.status = status
-            if result is not None:
-                task.result = result
-            db.session.commit()
-
-            # Send webhook notification if URL is configured
-            if task.webhook_url:
-                success = self._send_webhook_notification(task)
-                self.update_task_metadata(task_id, {
-                    'webhook_delivery': {
-                        'status': 'success' if success else 'failed',
-                        'timestamp': datetime.utcnow().isoformat(),
-                    }
-                })
+    def get_task_status(self, task_id: str) -> Optional[str]:
+        """Get only the status of a task, or None if it does not exist"""
+        return db.session.query(Task.status).filter(Task.id == task_id).scalar()
+
+    def get_all_tasks(self, limit: Optional[int] = None) -> List[Dict]:
+        """Get all tasks with their status, newest first"""
+        # Archived results are loaded in one query instead of one per archived task
+        query = Task.query.options(selectinload(Task.archive)).order_by(Task.created_at.desc())
+        if limit:
+            query = query.limit(limit)
+        return [task.to_dict() for task in query]
+
+    def update_task(self, task_id: str, status: str, result: Optional[str] = None,
+                    metadata: Optional[Dict] = None,
+                    from_status: Optional[Iterable[str]] = None,
+                    notify_in_background: bool = False) -> bool:
+        """Update task status, result and metadata, then send the webhook notification.
+
+        Moves into completed/failed/cancelled only happen from a non-terminal
+        status, so a late failure cannot overwrite a finished or cancelled task. Returns False if the
+        transition did not apply. Request handlers pass notify_in_background so a
+        slow webhook receiver does not hold the request.
+        """
+        if from_status is None and status in TERMINAL_STATUSES:
+            from_status = ('pending',)
+        task = self.transition(task_id, status, result=result, metadata=metadata, from_status=from_status)
+        if task is None:
+            logger.warning(f"Task {task_id} was not moved to {status}: missing or already finished")
+            return False
+
+        # Send webhook notification if URL is configured
+        if task.webhook_url:
+            if notify_in_background:
+                self._send_webhook_in_background(task)
+            else:
+                self._send_webhook_notification(task)
+        return True
+
+    def _send_webhook_in_background(self, task):
+        app = current_app._get_current_object()
+
+        def send():
+            with app.app_context():
+                self._send_webhook_notification(task)
+
+        thread = threading.Thread(target=send, name=f"webhook-{task.id}")
+        thread.daemon = True
+        thread.start()
 
     def update_task_metadata(self, task_id: str, metadata: Dict):
-        """Update task metadata"""
-        task = Task.query.get(task_id)
-        if task:
-            current_metadata = task.task_metadata or {}
-            current_metadata.update(metadata)
-            task.task_metadata = current_metadata
-            db.session.commit()
+        """Merge keys into the task metadata in a single statement"""
+        self.transition(task_id, metadata=metadata)
+
+    def transition(self, task_id: str, status: Optional[str] = None, result: Optional[str] = None,
+                   metadata: Optional[Dict] = None, from_status: Optional[Iterable[str]] = None,
+                   **values):
+        """Apply a status change, result and shallow metadata merge in one UPDATE.
 
-    def _send_webhook_notification(self, task: Task) -> bool:
+        When from_status is given the update only applies while the task is in one
+        of those statuses (compare-and-set). Returns the updated row, or None if
+        no row matched.
+        """
+        if status is not None:
+            values['status'] = status
+            if status == 'completed':
+                values['completed_at'] = datetime.utcnow()
+        if result is not None:
+            values['result'] = result
+        if metadata:
+            values['task_metadata'] = self._merge_metadata(task_id, metadata)
+        if not values:
+            return None
+        values['version'] = Task.version + 1
+
+        columns = (Task.id, Task.user_id, Task.status, Task.result, Task.created_at,
+                   Task.completed_at, Task.webhook_url, Task.version)
+        stmt = update(Task).where(Task.id == task_id)
+        if from_status is not None:
+            stmt = stmt.where(Task.status.in_(list(from_status)))
+        stmt = stmt.values(**values).execution_options(synchronize_session=False)
+
+        if db.session.get_bind().dialect.update_returning:
+            row = db.session.execute(stmt.returning(*columns)).first()
+        else:
+            # MySQL and MariaDB have no UPDATE ... RETURNING: read the row back in the same transaction
+            matched = db.session.execute(stmt).rowcount
+            row = db.session.query(*columns).filter(Task.id == task_id).first() if matched else None
+        db.session.commit()
+        if row is not None:
+            task_response_cache.invalidate(task_id)
+        return row
+
+    def save_profile(self, task_id: str, profile: Dict):
+        """Store a task's sampling profile and a summary of it in the task metadata"""
+        db.session.merge(TaskProfile(task_id=task_id, samples=profile['samples'],
+                                     profile=compress_result(json.dumps(profile, ensure_ascii=False))))
+        db.session.commit()
+        self.update_task_metadata(task_id, {'profile': {
+            key: profile[key] for key in ('hz', 'samples', 'duration_s', 'overhead_s')
+        }})
+
+    def get_profile(self, task_id: str) -> Optional[Dict]:
+        """Get a task's sampling profile, or None if it was not profiled"""
+        blob = db.session.query(TaskProfile.profile).filter(TaskProfile.task_id == task_id).scalar()
+        return json.loads(decompress_result(blob)) if blob is not None else None
+
+    def _merge_metadata(self, task_id: str, patch: Dict):
+        """SQL expression merging patch into task_metadata, like dict.update"""
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            current = func.coalesce(cast(Task.task_metadata, JSONB), cast(literal('{}'), JSONB))
+            merged = current.op('||')(cast(bindparam(None, json.dumps(patch)), JSONB))
+            return cast(merged, Task.task_metadata.type)
+        if dialect == 'sqlite':
+            args = []
+            for key, value in patch.items():
+                args += ['$."%s"' % key.replace('"', '""'), func.json(json.dumps(value))]
+            return func.json_set(func.coalesce(Task.task_metadata, '{}'), *args)
+
+        # Other dialects (MySQL, MariaDB): lock the row and merge in Python within the same transaction
+        current = (db.session.query(Task.task_metadata)
+                   .filter(Task.id == task_id)
+                   .with_for_update()
+                   .scalar()) or {}
+        return {**current, **patch}
+
+    def _send_webhook_notification(self, task) -> bool:
         """
         Send webhook notification for task updates
+        task is the row returned by transition()
         Returns: bool indicating success/failure
         """
         if not task.webhook_url:
@@ -117,17 +266,14 @@ class TaskQueue:
             logger.info(f"Sending webhook for task {task.id} with payload size: {len(str(payload))} bytes")
 
             # Store the payload and attempt time before sending
-            task.last_webhook_attempt = datetime.utcnow()
-            task.webhook_retries += 1
-
-            # Store the payload in task metadata
-            current_metadata = task.task_metadata or {}
-            current_metadata['webhook_delivery'] = {
+            attempt_time = datetime.utcnow()
+            delivery = {
                 'last_payload': payload,
-                'timestamp': task.last_webhook_attempt.isoformat()
+                'timestamp': attempt_time.isoformat()
             }
-            task.task_metadata = current_metadata
-            db.session.commit()
+            self.transition(task.id, metadata={'webhook_delivery': delivery},
+                            last_webhook_attempt=attempt_time,
+                            webhook_retries=func.coalesce(Task.webhook_retries, 0) + 1)
 
             response = self.session.post(
                 task.webhook_url,
@@ -143,13 +289,12 @@ class TaskQueue:
                        f"Response: {response.text[:200]}...")  # Log first 200 chars of response
 
             # Update metadata with success status
-            current_metadata['webhook_delivery']['status'] = 'success'
-            current_metadata['webhook_delivery']['response'] = {
+            delivery['status'] = 'success'
+            delivery['response'] = {
                 'status_code': response.status_code,
                 'response_text': response.text[:200]  # Store first 200 chars of response
             }
-            task.task_metadata = current_metadata
-            db.session.commit()
+            self.update_task_metadata(task.id, {'webhook_delivery': delivery})
 
             return True
 
@@ -160,14 +305,12 @@ class TaskQueue:
             logger.error(f"Traceback: {traceback.format_exc()}")
 
             # Update metadata with failure status
-            current_metadata = task.task_metadata or {}
-            current_metadata['webhook_delivery']['status'] = 'failed'
-            current_metadata['webhook_delivery']['error'] = {
+            delivery['status'] = 'failed'
+            delivery['error'] = {
                 'type': type(e).__name__,
                 'message': str(e)
             }
-            task.task_metadata = current_metadata
-            db.session.commit()
+            self.update_task_metadata(task.id, {'webhook_delivery': delivery})
 
             return False
 
@@ -0,0 +1,50 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+_state = {'enabled': False, 'started': False}
+_lock = threading.Lock()
+
+
+def _init_agentops(api_key: str):
+    try:
+        import agentops
+        agentops.init(api_key)
+        _state['enabled'] = True
+        logger.info("AgentOps telemetry initialized")
+    except Exception as e:
+        logger.warning(f"AgentOps initialization failed, telemetry disabled: {str(e)}")
+
+
+def init_telemetry():
+    """Start AgentOps in the background if AGENTOPS_API_KEY is configured.
+
+    Telemetry is optional: without a key, or if initialization fails, every
+    call in this module becomes a no-op. Calling it more than once is safe.
+    """
+    with _lock:
+        if _state['started']:
+            return
+        _state['started'] = True
+
+    api_key = os.environ.get("AGENTOPS_API_KEY")
+    if not api_key:
+        logger.info("AGENTOPS_API_KEY not set, telemetry disabled")
+        return
+
+    thread = threading.Thread(target=_init_agentops, args=(api_key,), name="agentops-init")
+    thread.daemon = True
+    thread.start()
+
+
+def end_session(status: str):
+    """End the current AgentOps session if telemetry is enabled"""
+    if not _state['enabled']:
+        return
+    try:
+        import agentops
+        agentops.end_session(status)
+    except Exception as e:
+        logger.warning(f"Failed to end AgentOps session: {str(e)}")
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+import llm_batcher
+
+
+def analysis_reply(prompt):
+    """Stub completion: batches get an unusable reply, "bad" gets no keyword"""
+    if prompt.startswith("Each entry"):
+        return "not json"
+    query = prompt.split('"')[1]
+    return json.dumps({"keyword": "" if query == "bad" else f"kw {query}", "variant_terms": []})
+
+
+def test_failed_query_only_fails_its_own_caller(monkeypatch):
+    monkeypatch.setattr(llm_batcher.service, "complete", analysis_reply)
+    batcher = llm_batcher.MicroBatcher("test_analysis", llm_batcher.service.analyze_queries,
+                                       max_wait=0.5, max_batch=3)
+    futures = {query: batcher.submit(query) for query in ("tea", "bad", "cup")}
+
+    assert futures["tea"].result(timeout=5)["keyword"] == "kw tea"
+    assert futures["cup"].result(timeout=5)["keyword"] == "kw cup"
+    with pytest.raises(ValueError):
+        futures["bad"].result(timeout=5)
+    assert batcher.stats()["batches"] == 1
+
+
+def test_title_batch_retries_are_bounded(monkeypatch):
+    calls = []
+
+    def miscount(prompt):
+        calls.append(prompt)
+        return "[]"
+
+    monkeypatch.setattr(llm_batcher.service, "complete", miscount)
+    assert llm_batcher.service.translate_titles([f"title {i}" for i in range(50)]) == [""] * 50
+    assert len(calls) == 3
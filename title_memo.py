@@ -0,0 +1,190 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from flask import has_app_context
+from sqlalchemy.exc import IntegrityError
+
+import llm_batcher
+import task_control
+from database import db
+from models import TitleTranslation
+
+logger = logging.getLogger(__name__)
+
+# TITLE_MEMO_ENABLED=false translates every title on every task
+ENABLED = os.environ.get("TITLE_MEMO_ENABLED", "true").lower() == "true"
+MEMORY_SIZE = int(os.environ.get("TITLE_MEMO_MEMORY_SIZE", "5000"))
+
+
+def title_hash(title: str) -> str:
+    return hashlib.md5(title.strip().encode("utf-8")).hexdigest()
+
+
+def _has_title(item) -> bool:
+    return isinstance(item, dict) and isinstance(item.get('title'), str) and bool(item['title'].strip())
+
+
+def _rollback():
+    if has_app_context():
+        db.session.rollback()
+
+
+class TitleMemo:
+    """Persistent zh->en translations of item titles, keyed on item_id and a hash of the title.
+
+    Lookups go to a small in-process LRU, then to the title_translation table;
+    only titles found in neither are sent to the LLM, in one batched request.
+    A changed title hashes differently and is translated again. Without an
+    application context (benchmarks, scripts) only the in-process LRU is used.
+    """
+
+    def __init__(self, memory_size: int = MEMORY_SIZE):
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'lookups': 0, 'memory_hits': 0, 'db_hits': 0, 'misses': 0,
+                       'translated': 0, 'failed': 0, 'stored': 0}
+
+    def _remember(self, key: Tuple[str, str], english_title: str):
+        with self._lock:
+            self._memory[key] = english_title
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def lookup(self, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            self._stats['memory_hits'] += len(found)
+
+        missing = [key for key in keys if key not in found]
+        if missing and has_app_context():
+            rows = (db.session.query(TitleTranslation.item_id, TitleTranslation.title_hash,
+                                     TitleTranslation.english_title)
+                    .filter(TitleTranslation.item_id.in_({item_id for item_id, _ in missing}))
+                    .all())
+            wanted = set(missing)
+            for item_id, hashed, english_title in rows:
+                if (item_id, hashed) in wanted:
+                    found[(item_id, hashed)] = english_title
+                    self._remember((item_id, hashed), english_title)
+                    with self._lock:
+                        self._stats['db_hits'] += 1
+        return found
+
+    def store(self, translations: Dict[Tuple[str, str], str]):
+        for key, english_title in translations.items():
+            self._remember(key, english_title)
+        if not translations or not has_app_context():
+            return
+        try:
+            for (item_id, hashed), english_title in translations.items():
+                db.session.merge(TitleTranslation(item_id=item_id, title_hash=hashed, english_title=english_title))
+            db.session.commit()
+        except IntegrityError:
+            # Another worker stored the same titles first
+            db.session.rollback()
+            return
+        with self._lock:
+            self._stats['stored'] += len(translations)
+
+    def translate(self, items: List[Dict]):
+        """Fill english_title of result items in place.
+
+        Titles already translated in an item (by an agent, or kept from an
+        earlier result) are added to the memo rather than sent to the LLM. If the
+        LLM call fails the remaining titles stay untranslated.
+        """
+        keyed = [(item, (str(item.get('item_id') or ''), title_hash(item['title'])))
+                 for item in items if _has_title(item)]
+        if not keyed:
+            return
+        given = {key: item['english_title'] for item, key in keyed
+                 if isinstance(item.get('english_title'), str) and item['english_title'].strip()}
+        keys = list(dict.fromkeys(key for _, key in keyed))
+        try:
+            found = self.lookup(keys)
+        except Exception as e:
+            logger.warning(f"Title memo lookup failed: {str(e)}")
+            _rollback()
+            found = {}
+
+        titles = {}
+        for item, key in keyed:
+            if key not in given and key not in found:
+                titles.setdefault(key, item['title'])
+        with self._lock:
+            self._stats['lookups'] += len(keys)
+            self._stats['misses'] += len(titles)
+
+        translated = {}
+        if titles:
+            try:
+                english_titles = llm_batcher.translate_titles(list(titles.values()))
+                translated = {key: english_title for key, english_title in zip(titles, english_titles)
+                              if english_title and english_title.strip()}
+            except task_control.TaskAborted:
+                raise
+            except Exception as e:
+                logger.warning(f"Title translation failed: {str(e)}")
+            with self._lock:
+                self._stats['translated'] += len(translated)
+                self._stats['failed'] += len(titles) - len(translated)
+
+        new = {**{key: title for key, title in given.items() if key not in found}, **translated}
+        try:
+            self.store(new)
+        except Exception as e:
+            logger.warning(f"Failed to store title translations: {str(e)}")
+            _rollback()
+
+        for item, key in keyed:
+            if key not in given and key in found:
+                item['english_title'] = found[key]
+            elif key in translated:
+                item['english_title'] = translated[key]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = self._stats['memory_hits'] + self._stats['db_hits']
+            lookups = self._stats['lookups']
+            return {
+                **self._stats,
+                'enabled': ENABLED,
+                'hit_rate': round(hits / lookups, 4) if lookups else None,
+                'memory_entries': len(self._memory),
+            }
+
+
+title_memo = TitleMemo()
+
+
+def translate(items: List[Dict]):
+    """Fill english_title of result items, through the memo unless TITLE_MEMO_ENABLED is false"""
+    if ENABLED:
+        return title_memo.translate(items)
+    items = [item for item in items if _has_title(item)]
+    if not items:
+        return
+    try:
+        english_titles = llm_batcher.translate_titles([item['title'] for item in items])
+    except task_control.TaskAborted:
+        raise
+    except Exception as e:
+        logger.warning(f"Title translation failed: {str(e)}")
+        return
+    for item, english_title in zip(items, english_titles):
+        if english_title:
+            item['english_title'] = english_title
+
+
+def stats() -> Dict:
+    return title_memo.stats()
@@ -0,0 +1,342 @@
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CATALOG_PATH = os.getenv("CATALOG_PATH", "catalog.sqlite")
+
+# Share of query n-grams a title must contain to count as a match
+MATCH_RATIO = float(os.getenv("CATALOG_MATCH_RATIO", "0.8"))
+
+# How often a worker's index picks up items ingested by other workers
+REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "30"))
+REFRESH_LOOKBACK = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    item_id TEXT PRIMARY KEY,
+    title TEXT,
+    product_url TEXT,
+    price REAL,
+    goods_score REAL,
+    repurchase_rate REAL,
+    orders_count INTEGER,
+    sku_props TEXT,
+    updated_at REAL NOT NULL
+)
+"""
+
+UPSERT = """
+INSERT INTO items (item_id, title, product_url, price, goods_score, repurchase_rate,
+                   orders_count, sku_props, updated_at)
+VALUES (:item_id, :title, :product_url, :price, :goods_score, :repurchase_rate,
+        :orders_count, :sku_props, :updated_at)
+ON CONFLICT(item_id) DO UPDATE SET
+    title = COALESCE(excluded.title, items.title),
+    product_url = COALESCE(excluded.product_url, items.product_url),
+    price = COALESCE(excluded.price, items.price),
+    goods_score = COALESCE(excluded.goods_score, items.goods_score),
+    repurchase_rate = COALESCE(excluded.repurchase_rate, items.repurchase_rate),
+    orders_count = COALESCE(excluded.orders_count, items.orders_count),
+    sku_props = COALESCE(excluded.sku_props, items.sku_props),
+    updated_at = excluded.updated_at
+"""
+
+UPDATED_AT_INDEX = "CREATE INDEX IF NOT EXISTS items_updated_at ON items (updated_at)"
+
+COLUMNS = ("item_id", "title", "product_url", "price", "goods_score",
+           "repurchase_rate", "orders_count", "sku_props", "updated_at")
+
+
+def _number(value) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r'-?\d+(?:\.\d+)?', str(value))
+    return float(match.group()) if match else None
+
+
+def ngrams(text: str) -> List[str]:
+    """Character bigrams of the lowercased text with whitespace removed.
+
+    Bigrams work for CJK titles, which have no word boundaries, and still match
+    Latin fragments such as model numbers or "500g".
+    """
+    text = re.sub(r'\s+', '', text or '').lower()
+    if len(text) < 2:
+        return [text] if text else []
+    return list(dict.fromkeys(text[i:i + 2] for i in range(len(text) - 1)))
+
+
+def record_from_search(item: dict) -> dict:
+    """Map a raw tmapi search item to a catalog record"""
+    return {
+        "item_id": str(item.get("item_id", "")),
+        "title": item.get("title") or None,
+        "product_url": item.get("product_url") or None,
+        "price": _number(item.get("price")),
+        "goods_score": _number(item.get("goods_score")),
+        "repurchase_rate": _number(item.get("item_repurchase_rate")),
+        "orders_count": _number((item.get("sale_info") or {}).get("orders_count")),
+        "sku_props": None,
+    }
+
+
+def record_from_detail(detail: dict) -> dict:
+    """Map a tmapi item detail payload to a catalog record"""
+    return {
+        "item_id": str(detail.get("item_id", "")),
+        "title": detail.get("title") or None,
+        "product_url": detail.get("product_url") or None,
+        "price": _number((detail.get("price_info") or {}).get("price")),
+        "goods_score": None,
+        "repurchase_rate": None,
+        "orders_count": None,
+        "sku_props": json.dumps(detail["sku_props"], ensure_ascii=False) if detail.get("sku_props") else None,
+    }
+
+
+class _Index:
+    """In-memory bigram index and numeric columns over catalog records"""
+
+    def __init__(self):
+        self.postings: Dict[str, array] = {}
+        self.doc_of: Dict[str, int] = {}
+        self.item_ids: List[str] = []
+        self.titles: List[Optional[str]] = []
+        self.alive = bytearray()
+        self.price = array('d')
+        self.score = array('d')
+        self.repurchase = array('d')
+        self.orders = array('d')
+        # Highest updated_at indexed; later SQLite writes are read from here on refresh
+        self.updated_at = 0.0
+
+    def add(self, row):
+        """Index a row of COLUMNS, replacing an earlier version of the item"""
+        item_id, title = row[0], row[1]
+        doc = self.doc_of.get(item_id)
+        if doc is not None and self.titles[doc] != title:
+            # Postings are append-only; a changed title gets a fresh document
+            self.alive[doc] = 0
+            doc = None
+
+        if doc is None:
+            doc = len(self.item_ids)
+            self.doc_of[item_id] = doc
+            self.item_ids.append(item_id)
+            self.titles.append(title)
+            self.alive.append(1)
+            for column in (self.price, self.score, self.repurchase, self.orders):
+                column.append(math.nan)
+            for gram in ngrams(title):
+                postings = self.postings.get(gram)
+                if postings is None:
+                    postings = self.postings[gram] = array('I')
+                postings.append(doc)
+
+        for column, value in ((self.price, row[3]), (self.score, row[4]),
+                              (self.repurchase, row[5]), (self.orders, row[6])):
+            column[doc] = math.nan if value is None else value
+        self.updated_at = max(self.updated_at, row[8])
+
+
+class ItemCatalog:
+    """Local catalog of every item seen in tmapi search and detail responses.
+
+    Records are persisted in SQLite. Title search uses an in-memory inverted index
+    of character bigrams; price, score and order filters use dense numeric arrays
+    kept alongside it. Each worker process builds its own index from SQLite on its
+    first query, on a separate connection so ingestion is not blocked meanwhile,
+    and then adds its own ingests as they happen. Items written by other
+    processes are picked up by re-reading the rows updated since the last
+    refresh, at most every CATALOG_REFRESH_SECONDS, so they can be that late.
+    """
+
+    def __init__(self, path: str = CATALOG_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._conn = None
+        self._index: Optional[_Index] = None
+        self._refreshed = 0.0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(SCHEMA)
+            self._conn.execute(UPDATED_AT_INDEX)
+        return self._conn
+
+    # Ingestion
+
+    def ingest_search(self, raw_items: Iterable[dict]):
+        self.upsert([record_from_search(item) for item in raw_items])
+
+    def ingest_detail(self, detail: dict):
+        if detail and detail.get("item_id"):
+            self.upsert([record_from_detail(detail)])
+
+    def upsert(self, records: List[dict]):
+        """Insert or update records; fields that are None keep their stored value"""
+        records = [r for r in records if r.get("item_id")]
+        if not records:
+            return
+        now = time.time()
+        with self._lock:
+            with self.conn:
+                self.conn.executemany(UPSERT, [{**r, "updated_at": now} for r in records])
+            if self._index is not None:
+                placeholders = ",".join("?" * len(records))
+                rows = self.conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM items WHERE item_id IN ({placeholders})",
+                    [r["item_id"] for r in records]).fetchall()
+                for row in rows:
+                    self._index.add(row)
+
+    # Index maintenance
+
+    def _catch_up(self, index: _Index):
+        """Index rows written since index.updated_at; call with self._lock held"""
+        # Writers stamp updated_at before committing, so look back a little for late commits
+        rows = self.conn.execute(f"SELECT {', '.join(COLUMNS)} FROM items WHERE updated_at >= ?",
+                                 (index.updated_at - REFRESH_LOOKBACK,)).fetchall()
+        for row in rows:
+            index.add(row)
+        self._refreshed = time.monotonic()
+
+    def load(self):
+        """Build the in-memory index from SQLite if it has not been built yet"""
+        if self._index is not None:
+            return
+        with self._build_lock:
+            if self._index is not None:
+                return
+            started = time.perf_counter()
+            with self._lock:
+                self.conn  # creates the schema
+            index = _Index()
+            conn = sqlite3.connect(self.path)
+            try:
+                for row in conn.execute(f"SELECT {', '.join(COLUMNS)} FROM items ORDER BY rowid"):
+                    index.add(row)
+            finally:
+                conn.close()
+            with self._lock:
+                # Rows ingested while the index was being built
+                self._catch_up(index)
+                self._index = index
+            logger.info("Loaded %d catalog items in %.2fs", len(index.doc_of), time.perf_counter() - started)
+
+    def refresh(self):
+        """Index rows written by other processes since the last refresh"""
+        with self._lock:
+            if self._index is not None:
+                self._catch_up(self._index)
+
+    # Queries
+
+    def search(self, query: str, min_price: Optional[float] = None, max_price: Optional[float] = None,
+               min_score: Optional[float] = None, min_orders: Optional[float] = None,
+               limit: int = 20) -> List[dict]:
+        """Return catalog items whose titles match the query, best matches and most orders first"""
+        self.load()
+        if time.monotonic() - self._refreshed >= REFRESH_SECONDS:
+            self.refresh()
+        grams = ngrams(query)
+        if not grams:
+            return []
+
+        with self._lock:
+            index = self._index
+            lists = sorted((index.postings.get(g, array('I')) for g in grams), key=len)
+            required = max(1, math.ceil(len(grams) * MATCH_RATIO))
+            # A document matching `required` grams must appear in one of the rarest lists
+            seed = lists[:len(lists) - required + 1]
+            candidates = set()
+            for postings in seed:
+                candidates.update(postings)
+
+            def contains(postings, doc):
+                i = bisect_left(postings, doc)
+                return i < len(postings) and postings[i] == doc
+
+            def passes(doc):
+                price, score, orders = index.price[doc], index.score[doc], index.orders[doc]
+                if min_price is not None and not price >= min_price:
+                    return False
+                if max_price is not None and not price <= max_price:
+                    return False
+                if min_score is not None and not score >= min_score:
+                    return False
+                if min_orders is not None and not orders >= min_orders:
+                    return False
+                return True
+
+            matches = []
+            for doc in candidates:
+                if not index.alive[doc] or not passes(doc):
+                    continue
+                hits = sum(1 for postings in lists if contains(postings, doc))
+                if hits >= required:
+                    orders = index.orders[doc]
+                    matches.append((hits, 0.0 if math.isnan(orders) else orders, doc))
+
+            matches.sort(reverse=True)
+            item_ids = [index.item_ids[doc] for _, _, doc in matches[:limit]]
+
+        return self.get_items(item_ids)
+
+    def get_items(self, item_ids: List[str]) -> List[dict]:
+        """Fetch stored records for item_ids, preserving their order"""
+        if not item_ids:
+            return []
+        placeholders = ",".join("?" * len(item_ids))
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM items WHERE item_id IN ({placeholders})",
+                item_ids).fetchall()
+        by_id = {row[0]: dict(zip(COLUMNS, row)) for row in rows}
+        return [by_id[item_id] for item_id in item_ids if item_id in by_id]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            index = self._index
+            return {
+                "loaded": index is not None,
+                "items": self.conn.execute("SELECT COUNT(*) FROM items").fetchone()[0],
+                "indexed": len(index.doc_of) if index else 0,
+                "ngrams": len(index.postings) if index else 0,
+            }
+
+
+def to_search_item(record: dict) -> dict:
+    """Format a catalog record like a search1688 result item"""
+    def text(value, default="No data available"):
+        return default if value is None else f"{value:g}" if isinstance(value, float) else str(value)
+
+    return {
+        "title": record.get("title") or "",
+        "item_id": record["item_id"],
+        "product_url": record.get("product_url") or "",
+        "item_score": text(record.get("goods_score")),
+        "repurchase_rate": text(record.get("repurchase_rate")) + ("%" if record.get("repurchase_rate") is not None else ""),
+        "orders_count": text(record.get("orders_count"), "0"),
+        "price": "" if record.get("price") is None else f"{record['price']:.2f}",
+        "is_p4p": False,
+    }
+
+
+catalog = ItemCatalog()
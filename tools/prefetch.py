@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("future", "created_at", "read")
+
+    def __init__(self, future: Future):
+        self.future = future
+        self.created_at = time.monotonic()
+        self.read = False
+
+
+class ResponsePrefetcher:
+    """Speculatively fetch responses in the background and hand them out on demand.
+
+    Entries live for ``ttl`` seconds. An entry that expires or is evicted before
+    anyone asks for it is counted as a wasted fetch.
+    """
+
+    def __init__(self, fetch: Callable[[str], dict], max_workers: int = 4,
+                 ttl: float = 600.0, max_entries: int = 500):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self._stats = {"issued": 0, "hits": 0, "misses": 0, "wasted": 0, "failed": 0}
+
+    def prefetch(self, keys: Iterable[str]):
+        """Schedule background fetches for keys that are not already cached or in flight"""
+        with self._lock:
+            self._sweep()
+            for key in keys:
+                key = str(key)
+                if key in self._entries:
+                    continue
+                if len(self._entries) >= self.max_entries:
+                    self._evict_oldest()
+                self._entries[key] = _Entry(self._executor.submit(self.fetch, key))
+                self._stats["issued"] += 1
+
+    def get(self, key: str, timeout: Optional[float] = None) -> Optional[dict]:
+        """Return the prefetched response for key, waiting for an in-flight fetch.
+
+        Returns None when the key was not prefetched or the prefetch failed.
+        """
+        key = str(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry.created_at > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+
+        try:
+            response = entry.future.result(timeout=timeout)
+        except Exception as e:
+            logger.debug("Prefetch for %s failed: %s", key, e)
+            response = None
+
+        with self._lock:
+            if response is None:
+                self._stats["failed"] += 1
+                self._stats["misses"] += 1
+                self._entries.pop(key, None)
+                return None
+            entry.read = True
+            self._stats["hits"] += 1
+        return response
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            issued = self._stats["issued"]
+            return {
+                **self._stats,
+                "cached": len(self._entries),
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else None,
+                "waste_rate": round(self._stats["wasted"] / issued, 4) if issued else None,
+            }
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        if not entry.read:
+            self._stats["wasted"] += 1
+
+    def _sweep(self):
+        now = time.monotonic()
+        for key in [k for k, e in self._entries.items() if now - e.created_at > self.ttl]:
+            self._drop(key)
+
+    def _evict_oldest(self):
+        oldest = min(self._entries, key=lambda k: self._entries[k].created_at)
+        self._drop(oldest)
@@ -1,24 +1,14 @@
-from crewai.tools import BaseTool, tool
-from typing import Type
-from pydantic import BaseModel, Field
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-import os
-import json
-import hashlib
+from crewai.tools import tool
 import logging
 
+import circuit_breaker
+import sku_matcher
+from tools import tmapi
+from tools.tmapi import search_items, get_item_detail, search_catalog
+
 # Configure logging
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-# Set API_MODE to either "online" or "mocked_data" (default: online)
-API_MODE = os.getenv("API_MODE", "online").lower()
-CACHE_DIR = "api_cache"
 
-if not os.path.exists(CACHE_DIR):
-    os.makedirs(CACHE_DIR)
 
 @tool("search1688")
 def search1688(query: str,
@@ -35,87 +25,7 @@ def search1688(query: str,
 
     Returns:
         dict: List of items with their details."""
-    base_url = "http://api.tmapi.top/1688"
-    api_token = os.environ.get("TMAPI_TOKEN")
-
-    endpoint = f"{base_url}/search/items"
-    params = {
-        "page": page,
-        "page_size": page_size,
-        "keyword": query,
-        "sort": sort,
-        "apiToken": api_token
-    }
-
-    # Create a unique key for caching based on the search parameters
-    key = hashlib.md5(
-        f"{query}_{page}_{page_size}_{sort}".encode("utf-8")).hexdigest()
-    cache_file = os.path.join(CACHE_DIR, f"search_{key}.json")
-
-    logger.debug(f"Search request - Mode: {API_MODE}, Query: {query}, Cache file: {cache_file}")
-
-    if API_MODE == "mocked_data":
-        logger.info("Using mocked data mode")
-        try:
-            with open(cache_file, "r") as f:
-                data = json.load(f)
-                logger.debug("Successfully loaded mock data from cache")
-        except Exception as e:
-            logger.warning(f"Failed to load mock data: {str(e)}")
-            return {"items": [], "error": "No cached data available"}
-    else:
-        logger.info("Using online mode - making API request")
-        if not api_token:
-            logger.error("API token not found")
-            return {"items": [], "error": "API token not configured"}
-
-        try:
-            # Configure retry strategy
-            retry_strategy = Retry(
-                total=3,  # number of retries
-                backoff_factor=1,  # wait 1, 2, 4 seconds between retries
-                status_forcelist=[408, 429, 500, 502, 503, 504]  # status codes to retry on
-            )
-            adapter = HTTPAdapter(max_retries=retry_strategy)
-            session = requests.Session()
-            session.mount("http://", adapter)
-            session.mount("https://", adapter)
-            
-            response = session.get(endpoint, params=params, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            logger.debug("Successfully received API response")
-
-            # Cache the response
-            try:
-                with open(cache_file, "w") as f:
-                    json.dump(data, f)
-                logger.debug("Successfully cached API response")
-            except Exception as e:
-                logger.warning(f"Failed to save search cache: {str(e)}")
-        except Exception as e:
-            logger.error(f"API request failed: {str(e)}")
-            return {"items": [], "error": str(e)}
-
-    if data.get("code") == 200:
-        items = []
-        for item in data.get("data", {}).get("items", []):
-            formatted_item = {
-                "title": item.get("title", ""),
-                "item_id": item.get("item_id", ""),
-                "product_url": item.get("product_url", ""),
-                "item_score": str(item.get("goods_score", "No data available")),
-                "repurchase_rate": str(item.get("item_repurchase_rate", "No data available")),
-                "orders_count": str(item.get("sale_info", {}).get("orders_count", 0)),
-                "price": item.get("price", ""),
-            }
-            items.append(formatted_item)
-        logger.info(f"Successfully processed {len(items)} items")
-        return {"items": items}
-    else:
-        error_msg = data.get("msg", "Unknown error")
-        logger.error(f"API Error: {error_msg}")
-        return {"items": [], "error": error_msg}
+    return search_items(query, page=page, page_size=page_size, sort=sort)
 
 
 @tool("item_detail")
@@ -126,68 +36,36 @@ def item_detail(item_id: str) -> dict:
         item_id (int): The unique identifier of the item.
 
     Returns:
-        dict: Detailed item information if successful; otherwise, an empty dictionary.
+        dict: Detailed item information if successful; otherwise, an empty dictionary,
+        or an "error" when the detail API is temporarily unavailable.
+        Variants in "skus" are ranked against the buyer's query and only the best
+        matches are returned; "selected_sku" is set when one variant clearly matches.
     """
-    base_url = "http://api.tmapi.top/1688"
-    api_token = os.environ.get("TMAPI_TOKEN")
-
-    endpoint = f"{base_url}/v2/item_detail"
-    params = {
-        "item_id": item_id,
-        "apiToken": api_token,
-    }
-
-    cache_file = os.path.join(CACHE_DIR, f"item_detail_{item_id}.json")
-
-    logger.debug(f"Detail request - Mode: {API_MODE}, Item ID: {item_id}, Cache file: {cache_file}")
+    detail = get_item_detail(item_id)
+    if not detail and tmapi.detail_breaker.state == circuit_breaker.OPEN:
+        return {"error": "Item details are temporarily unavailable; use the search result data for this item"}
+    if not sku_matcher.ENABLED or not detail:
+        return detail
+    return sku_matcher.trim_detail(detail, sku_matcher.current_constraints())
+
+
+@tool("search_local_catalog")
+def search_local_catalog(query: str,
+                         min_price: float = None,
+                         max_price: float = None,
+                         min_orders: int = None,
+                         limit: int = 20) -> dict:
+    """Search the local catalog of 1688.com items seen in earlier searches. It answers in
+    milliseconds and does not spend an API call.
 
-    if API_MODE == "mocked_data":
-        logger.info("Using mocked data mode for item detail")
-        try:
-            with open(cache_file, "r") as f:
-                data = json.load(f)
-                logger.debug("Successfully loaded mock item detail from cache")
-        except Exception as e:
-            logger.warning(f"Failed to load mock item detail: {str(e)}")
-            return {}
-    else:
-        logger.info("Using online mode - making API request for item detail")
-        if not api_token:
-            logger.error("API token not found")
-            return {}
-
-        try:
-            # Configure retry strategy
-            retry_strategy = Retry(
-                total=3,
-                backoff_factor=1,
-                status_forcelist=[408, 429, 500, 502, 503, 504]
-            )
-            adapter = HTTPAdapter(max_retries=retry_strategy)
-            session = requests.Session()
-            session.mount("http://", adapter)
-            session.mount("https://", adapter)
-            
-            response = session.get(endpoint, params=params, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            logger.debug("Successfully received item detail API response")
-
-            # Cache the response
-            try:
-                with open(cache_file, "w") as f:
-                    json.dump(data, f)
-                logger.debug("Successfully cached item detail response")
-            except Exception as e:
-                logger.warning(f"Failed to save item detail cache: {str(e)}")
-        except Exception as e:
-            logger.error(f"Item detail API request failed: {str(e)}")
-            return {}
+    Args:
+        query (str): Search keyword in Chinese.
+        min_price (float): Minimum price (optional).
+        max_price (float): Maximum price (optional).
+        min_orders (int): Minimum orders_count (optional).
+        limit (int): Maximum number of items (default: 20).
 
-    if data.get("code") == 200:
-        logger.info("Successfully retrieved item details")
-        return data.get("data", {})
-    else:
-        error_msg = data.get("msg", "Unknown error")
-        logger.error(f"Item detail API Error: {error_msg}")
-        return {}
\ No newline at end of file
+    Returns:
+        dict: List of items in the same format as search1688."""
+    return search_catalog(query, limit=limit, min_price=min_price,
+                          max_price=max_price, min_orders=min_orders)
@@ -0,0 +1,393 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import os
+import json
+import hashlib
+import logging
+import threading
+import time
+from typing import Optional
+
+import circuit_breaker
+import task_control
+from tools.prefetch import ResponsePrefetcher
+from tools.catalog import catalog, to_search_item
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+BASE_URL = "http://api.tmapi.top/1688"
+# Recorded responses served in mock mode; committed with the repo and never pruned
+CACHE_DIR = "api_cache"
+# Responses fetched from tmapi in online mode; retention prunes only this directory
+LIVE_CACHE_DIR = os.getenv("TMAPI_LIVE_CACHE_DIR", os.path.join(CACHE_DIR, "live"))
+
+# Seconds a cached response is served in online mode before tmapi is called again
+CACHE_TTL = int(os.getenv("CACHE_TTL", "21600"))
+
+# Number of top search results whose details are prefetched (0 disables prefetching)
+PREFETCH_TOP_N = int(os.getenv("PREFETCH_TOP_N", "5"))
+
+# Every search and detail response is added to the local item catalog
+CATALOG_ENABLED = os.getenv("CATALOG_ENABLED", "true").lower() == "true"
+
+# "tmapi" calls the API and falls back to the catalog on failure;
+# "local_first" answers from the catalog when it has CATALOG_MIN_RESULTS matches
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "tmapi").lower()
+CATALOG_MIN_RESULTS = int(os.getenv("CATALOG_MIN_RESULTS", "10"))
+
+# tmapi calls go through a circuit breaker, so they retry once with short timeouts
+# rather than holding a worker for minutes before the breaker can trip
+CONNECT_TIMEOUT = float(os.getenv("TMAPI_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("TMAPI_READ_TIMEOUT", "15"))
+MAX_RETRIES = int(os.getenv("TMAPI_MAX_RETRIES", "1"))
+
+os.makedirs(LIVE_CACHE_DIR, exist_ok=True)
+
+
+def _is_upstream_failure(error: BaseException) -> bool:
+    """Only 5xx, 429 and timeouts count against the breaker; a 4xx is the caller's own input"""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status in (408, 429)
+    return isinstance(error, (requests.Timeout, requests.ConnectionError, requests.exceptions.RetryError))
+
+
+# One breaker per endpoint; a cancelled or timed-out task is not an upstream failure
+search_breaker = circuit_breaker.get("tmapi.search", excluded=(task_control.TaskAborted,),
+                                     is_failure=_is_upstream_failure)
+detail_breaker = circuit_breaker.get("tmapi.item_detail", excluded=(task_control.TaskAborted,),
+                                     is_failure=_is_upstream_failure)
+
+_cache_stats = {"hits": 0, "misses": 0}
+_cache_stats_lock = threading.Lock()
+
+
+def is_mock_mode() -> bool:
+    """Return True when responses should be served from the recorded api_cache responses.
+
+    The mode is read on every call so that switching it through
+    /api/config/search_mode takes effect without a restart.
+    """
+    return os.getenv("API_MODE", "online").lower() in ("mock", "mocked_data")
+
+
+def _create_session() -> requests.Session:
+    """Create a requests session with the retry strategy used for tmapi calls"""
+    retry_strategy = Retry(
+        total=MAX_RETRIES,  # number of retries
+        backoff_factor=0.5,  # wait 0.5 seconds before the retry
+        status_forcelist=[408, 429, 500, 502, 503, 504],  # status codes to retry on
+        raise_on_status=False  # return the last response so raise_for_status reports its status
+    )
+    adapter = HTTPAdapter(max_retries=retry_strategy)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def cache_dir() -> str:
+    """The recorded responses in mock mode, the live response cache otherwise"""
+    return CACHE_DIR if is_mock_mode() else LIVE_CACHE_DIR
+
+
+def search_cache_file(query: str, page: int = 1, page_size: int = 20, sort: str = "sales") -> str:
+    """Return the cache file path for a search request"""
+    key = hashlib.md5(
+        f"{query}_{page}_{page_size}_{sort}".encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir(), f"search_{key}.json")
+
+
+def detail_cache_file(item_id) -> str:
+    """Return the cache file path for an item detail request"""
+    return os.path.join(cache_dir(), f"item_detail_{item_id}.json")
+
+
+def _load_cache(cache_file: str):
+    with open(cache_file, "r") as f:
+        return json.load(f)
+
+
+def cache_age(cache_file: str) -> Optional[float]:
+    """Return the age of a cache file in seconds, or None if it does not exist"""
+    try:
+        return time.time() - os.path.getmtime(cache_file)
+    except OSError:
+        return None
+
+
+def is_fresh(cache_file: str, max_age: Optional[float] = None) -> bool:
+    """Return True if the cache file exists and is younger than max_age (default CACHE_TTL)"""
+    age = cache_age(cache_file)
+    return age is not None and age <= (CACHE_TTL if max_age is None else max_age)
+
+
+def _load_fresh_cache(cache_file: str) -> Optional[dict]:
+    """Return a cached successful response younger than CACHE_TTL, if any"""
+    data = None
+    if is_fresh(cache_file):
+        try:
+            data = _load_cache(cache_file)
+        except Exception as e:
+            logger.warning(f"Failed to read cache {cache_file}: {str(e)}")
+        if data is not None and data.get("code") != 200:
+            data = None
+
+    with _cache_stats_lock:
+        _cache_stats["hits" if data is not None else "misses"] += 1
+    return data
+
+
+def _serve_stale(cache_file: str, breaker: circuit_breaker.CircuitBreaker) -> Optional[dict]:
+    """Return a cached successful response of any age while the breaker is open, if any"""
+    try:
+        data = _load_cache(cache_file)
+    except Exception:
+        return None
+    if data.get("code") != 200:
+        return None
+    breaker.record_fallback()
+    logger.warning(f"Serving {cache_file} ({cache_age(cache_file):.0f}s old) while {breaker.name} is unavailable")
+    return {**data, "stale": True}
+
+
+def cache_stats() -> dict:
+    with _cache_stats_lock:
+        lookups = _cache_stats["hits"] + _cache_stats["misses"]
+        return {
+            **_cache_stats,
+            "ttl": CACHE_TTL,
+            "hit_rate": round(_cache_stats["hits"] / lookups, 4) if lookups else None,
+        }
+
+
+def _save_cache(cache_file: str, data: dict):
+    try:
+        with open(cache_file, "w") as f:
+            json.dump(data, f)
+        logger.debug("Successfully cached response to %s", cache_file)
+    except Exception as e:
+        logger.warning(f"Failed to save cache {cache_file}: {str(e)}")
+
+
+def _request(endpoint: str, params: dict) -> dict:
+    session = _create_session()
+    # Running tasks clamp the timeout to their remaining budget
+    read_timeout = task_control.timeout(READ_TIMEOUT)
+    response = session.get(endpoint, params=params, timeout=(min(CONNECT_TIMEOUT, read_timeout), read_timeout))
+    response.raise_for_status()
+    return response.json()
+
+
+def format_search_item(item: dict) -> dict:
+    """Reduce a raw search result item to the fields used by the agents"""
+    return {
+        "title": item.get("title", ""),
+        "item_id": item.get("item_id", ""),
+        "product_url": item.get("product_url", ""),
+        "item_score": str(item.get("goods_score", "No data available")),
+        "repurchase_rate": str(item.get("item_repurchase_rate", "No data available")),
+        "orders_count": str(item.get("sale_info", {}).get("orders_count", 0)),
+        "price": item.get("price", ""),
+        "is_p4p": bool(item.get("is_p4p") or item.get("type") == "p4p"),
+    }
+
+
+def fetch_search(query: str, page: int = 1, page_size: int = 20, sort: str = "sales",
+                 refresh: bool = False) -> dict:
+    """Return the raw tmapi search response, reading or writing api_cache.
+
+    In online mode a cached response younger than CACHE_TTL is returned, marked
+    "cached", unless refresh is set. Raises an exception when no response could
+    be obtained.
+    """
+    cache_file = search_cache_file(query, page, page_size, sort)
+    logger.debug("Search request - Mock: %s, Query: %s, Cache file: %s", is_mock_mode(), query, cache_file)
+
+    if is_mock_mode():
+        return _load_cache(cache_file)
+
+    if not refresh:
+        cached = _load_fresh_cache(cache_file)
+        if cached is not None:
+            return {**cached, "cached": True}
+
+    api_token = os.environ.get("TMAPI_TOKEN")
+    if not api_token:
+        raise RuntimeError("API token not configured")
+
+    try:
+        data = search_breaker.call(_request, f"{BASE_URL}/search/items", {
+            "page": page,
+            "page_size": page_size,
+            "keyword": query,
+            "sort": sort,
+            "apiToken": api_token
+        })
+    except circuit_breaker.CircuitOpenError:
+        stale = _serve_stale(cache_file, search_breaker)
+        if stale is None:
+            raise
+        return stale
+    _save_cache(cache_file, data)
+    return data
+
+
+def fetch_item_detail(item_id, refresh: bool = False) -> dict:
+    """Return the raw tmapi item detail response, reading or writing api_cache.
+
+    In online mode a cached response younger than CACHE_TTL is returned, marked
+    "cached", unless refresh is set. Raises an exception when no response could
+    be obtained.
+    """
+    cache_file = detail_cache_file(item_id)
+    logger.debug("Detail request - Mock: %s, Item ID: %s, Cache file: %s", is_mock_mode(), item_id, cache_file)
+
+    if is_mock_mode():
+        return _load_cache(cache_file)
+
+    if not refresh:
+        cached = _load_fresh_cache(cache_file)
+        if cached is not None:
+            return {**cached, "cached": True}
+
+    api_token = os.environ.get("TMAPI_TOKEN")
+    if not api_token:
+        raise RuntimeError("API token not configured")
+
+    try:
+        data = detail_breaker.call(_request, f"{BASE_URL}/v2/item_detail", {
+            "item_id": item_id,
+            "apiToken": api_token,
+        })
+    except circuit_breaker.CircuitOpenError:
+        stale = _serve_stale(cache_file, detail_breaker)
+        if stale is None:
+            raise
+        return stale
+    _save_cache(cache_file, data)
+    return data
+
+
+def _prefetch_key(item: dict):
+    """Sort key for prefetch priority: most orders first, then best goods score"""
+    try:
+        orders = int(item.get("sale_info", {}).get("orders_count") or 0)
+    except (TypeError, ValueError):
+        orders = 0
+    try:
+        score = float(item.get("goods_score") or 0)
+    except (TypeError, ValueError):
+        score = 0.0
+    return orders, score
+
+
+def prefetch_details(raw_items: list):
+    """Start background detail fetches for the most promising non-p4p search results"""
+    if PREFETCH_TOP_N <= 0 or is_mock_mode() or detail_breaker.state == circuit_breaker.OPEN:
+        return
+    organic = [item for item in raw_items if not format_search_item(item)["is_p4p"] and item.get("item_id")]
+    organic.sort(key=_prefetch_key, reverse=True)
+    item_ids = [str(item["item_id"]) for item in organic[:PREFETCH_TOP_N]]
+    # Items with a fresh cached response are served from disk without a prefetch
+    item_ids = [item_id for item_id in item_ids if not is_fresh(detail_cache_file(item_id))]
+    logger.debug("Prefetching item details for %s", item_ids)
+    detail_prefetcher.prefetch(item_ids)
+
+
+def _ingest(method, payload, data: dict):
+    """Add a response to the catalog; responses served from api_cache were added when fetched"""
+    if not CATALOG_ENABLED or data.get("cached") or data.get("stale"):
+        return
+    try:
+        method(payload)
+    except Exception as e:
+        logger.warning(f"Failed to add response to the item catalog: {str(e)}")
+
+
+def search_catalog(query: str, limit: int = 20, **filters) -> dict:
+    """Search the local item catalog and return results in the search_items format"""
+    try:
+        records = catalog.search(query, limit=limit, **filters)
+    except Exception as e:
+        logger.error(f"Catalog search failed: {str(e)}")
+        return {"items": [], "error": str(e), "source": "local_catalog"}
+    return {"items": [to_search_item(record) for record in records], "source": "local_catalog"}
+
+
+def search_items(query: str, page: int = 1, page_size: int = 20, sort: str = "sales",
+                 refresh: bool = False) -> dict:
+    """Search items on 1688.com and return {"items": [...]} or {"items": [], "error": ...}
+
+    refresh bypasses the response cache and the local catalog, and skips detail
+    prefetching so the caller decides which details to fetch.
+    """
+    task_control.check()
+    if SEARCH_BACKEND == "local_first" and page == 1 and not refresh:
+        local = search_catalog(query, limit=page_size)
+        if len(local["items"]) >= min(CATALOG_MIN_RESULTS, page_size):
+            logger.info("Answered search for %s from the local catalog", query)
+            return local
+
+    try:
+        data = fetch_search(query, page, page_size, sort, refresh=refresh)
+    except Exception as e:
+        logger.error(f"Search request failed: {str(e)}")
+        return _search_fallback(query, page_size, str(e))
+
+    if data.get("code") == 200:
+        raw_items = data.get("data", {}).get("items", [])
+        _ingest(catalog.ingest_search, raw_items, data)
+        if not refresh:
+            prefetch_details(raw_items)
+        items = [format_search_item(item) for item in raw_items]
+        logger.info("Successfully processed %d items", len(items))
+        if data.get("stale"):
+            return {"items": items, "stale": True}
+        return {"items": items}
+
+    error_msg = data.get("msg", "Unknown error")
+    logger.error(f"API Error: {error_msg}")
+    return _search_fallback(query, page_size, error_msg)
+
+
+def _search_fallback(query: str, page_size: int, error_msg: str) -> dict:
+    """Serve catalog results when tmapi is unavailable, otherwise report the error"""
+    local = search_catalog(query, limit=page_size) if CATALOG_ENABLED else {"items": []}
+    if local["items"]:
+        logger.info(f"Serving {len(local['items'])} catalog items after search failure")
+        return {**local, "error": error_msg}
+    return {"items": [], "error": error_msg}
+
+
+def get_item_detail(item_id, refresh: bool = False) -> dict:
+    """Return the detail payload for an item, or an empty dict on failure.
+
+    refresh bypasses the prefetcher and the response cache.
+    """
+    task_control.check()
+    try:
+        data = None if is_mock_mode() or refresh else detail_prefetcher.get(item_id, timeout=task_control.timeout(30))
+        if data is None:
+            data = fetch_item_detail(item_id, refresh=refresh)
+    except Exception as e:
+        logger.error(f"Item detail request failed: {str(e)}")
+        return {}
+
+    if data.get("code") == 200:
+        logger.info("Successfully retrieved item details")
+        _ingest(catalog.ingest_detail, data.get("data", {}), data)
+        return data.get("data", {})
+
+    error_msg = data.get("msg", "Unknown error")
+    logger.error(f"Item detail API Error: {error_msg}")
+    return {}
+
+
+detail_prefetcher = ResponsePrefetcher(
+    fetch_item_detail,
+    max_workers=int(os.getenv("PREFETCH_WORKERS", "4")),
+    ttl=float(os.getenv("PREFETCH_TTL", "600")),
+)